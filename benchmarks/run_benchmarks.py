@@ -0,0 +1,236 @@
+"""読み込み・ウィンドウ処理・断面取り出し・描画の性能を計測し、JSONで出力する
+
+使い方の例::
+
+    python benchmarks/run_benchmarks.py --suite quick -o bench.json
+    python benchmarks/run_benchmarks.py --case 512x512x256:int16:rle
+
+結果は実行ごとに比較できるよう、環境情報とケースごとの計測値をJSONにまとめる。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pydicom
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from dicom_loader import load_series
+from slice_cache import plane_size, plane_slice
+from windowing import WindowingEngine, window_float
+
+from synthetic_series import write_series
+
+# (スライス数, マトリクス, dtype, 転送構文)
+SUITES = {
+    'quick': [
+        (64, 256, 'int16', 'explicit'),
+        (64, 256, 'uint16', 'implicit'),
+        (64, 256, 'uint8', 'explicit'),
+        (128, 512, 'int16', 'explicit'),
+        (64, 512, 'int16', 'rle'),
+    ],
+    'full': [
+        (64, 256, 'int16', 'explicit'),
+        (256, 512, 'int16', 'explicit'),
+        (256, 512, 'uint16', 'implicit'),
+        (256, 512, 'int16', 'rle'),
+        (1000, 512, 'int16', 'explicit'),
+        (2000, 512, 'int16', 'explicit'),
+        (128, 1024, 'int16', 'explicit'),
+        (512, 1024, 'uint16', 'explicit'),
+    ],
+}
+
+
+def parse_case(spec):
+    """'512x512x256:int16:explicit'（幅x高さxスライス数）をケースにする"""
+    parts = spec.split(':')
+    width, height, slices = (int(v) for v in parts[0].lower().split('x'))
+    if width != height:
+        raise ValueError("合成シリーズは正方マトリクスのみ対応しています")
+    dtype = parts[1] if len(parts) > 1 else 'int16'
+    syntax = parts[2] if len(parts) > 2 else 'explicit'
+    return slices, width, dtype, syntax
+
+
+def timed(func, repeat):
+    """func を repeat 回実行し、各回の所要時間(秒)の一覧を返す"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times):
+    ms = sorted(t * 1000 for t in times)
+    return {
+        'mean_ms': statistics.mean(ms),
+        'median_ms': statistics.median(ms),
+        'min_ms': ms[0],
+        'max_ms': ms[-1],
+        'n': len(ms),
+    }
+
+
+def bench_load(paths, workers):
+    """読み込み時間と、別の実行でのピークメモリ（tracemallocは遅いため分ける）"""
+    tracemalloc.start()
+    volume, _ = load_series(paths, max_workers=workers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    volume.close()
+    start = time.perf_counter()
+    volume, _ = load_series(paths, max_workers=workers)
+    elapsed = time.perf_counter() - start
+    return volume, {
+        'seconds': elapsed,
+        'slices_per_s': volume.shape[0] / elapsed,
+        'peak_traced_mb': peak / 1024 ** 2,
+        'volume_mb': volume.nbytes / 1024 ** 2,
+    }
+
+
+def bench_window(volume, repeat):
+    engine = WindowingEngine()
+    image = volume[volume.shape[0] // 2]
+    engine.apply(image, 400, 40, buffer='bench')
+    windows = [(400 + i, 40 + i) for i in range(repeat)]
+    megapixels = image.size / 1e6
+    results = {}
+    lut_cached = summarize(timed(lambda: engine.apply(image, 400, 40, buffer='bench'), repeat))
+    results['lut_cached'] = dict(lut_cached, mpix_per_s=megapixels / (lut_cached['mean_ms'] / 1000))
+    iterator = iter(windows)
+    lut_new = summarize(timed(lambda: engine.apply(image, *next(iterator), buffer='bench'), repeat))
+    results['lut_new_window'] = dict(lut_new, mpix_per_s=megapixels / (lut_new['mean_ms'] / 1000))
+    float_path = summarize(timed(lambda: window_float(image, 400, 40), repeat))
+    results['float'] = dict(float_path, mpix_per_s=megapixels / (float_path['mean_ms'] / 1000))
+    return results
+
+
+def bench_planes(volume, repeat):
+    results = {}
+    for plane in ("Axial", "Sagittal", "Coronal"):
+        count = plane_size(volume.shape, plane)
+        indices = iter(np.linspace(0, count - 1, repeat).astype(int))
+        results[plane] = summarize(timed(lambda: np.ascontiguousarray(plane_slice(volume, plane, next(indices))),
+                                         repeat))
+    return results
+
+
+def bench_render(volume, repeat):
+    """ビューアと同じ構成のFigureで、全体描画とブリット描画の1フレーム時間を測る"""
+    engine = WindowingEngine()
+    fig = Figure(figsize=(10, 5.5), facecolor='#2b2b2b')
+    canvas = FigureCanvasAgg(fig)
+    ax1 = fig.add_subplot(121)
+    ax2 = fig.add_subplot(122)
+    first = engine.apply(plane_slice(volume, "Axial", 0), 400, 40)
+    other = engine.apply(plane_slice(volume, "Sagittal", 0), 400, 40)
+    image1 = ax1.imshow(first, cmap='gray', aspect='auto', vmin=0, vmax=255, animated=True)
+    image2 = ax2.imshow(other, cmap='gray', aspect='auto', vmin=0, vmax=255, animated=True)
+    for ax in (ax1, ax2):
+        ax.axis('off')
+    fig.tight_layout()
+    canvas.draw()
+    background = canvas.copy_from_bbox(ax1.bbox)
+    count = volume.shape[0]
+    state = {'z': 0}
+
+    def next_axial():
+        state['z'] = (state['z'] + 1) % count
+        image1.set_data(engine.apply(plane_slice(volume, "Axial", state['z']), 400, 40, buffer='axial'))
+
+    def blit_frame():
+        next_axial()
+        canvas.restore_region(background)
+        ax1.draw_artist(image1)
+        canvas.blit(ax1.bbox)
+
+    def full_frame():
+        next_axial()
+        image1.set_animated(False)
+        image2.set_animated(False)
+        canvas.draw()
+
+    return {'blit': summarize(timed(blit_frame, repeat)), 'full_draw': summarize(timed(full_frame, repeat))}
+
+
+def run_case(case, data_dir, workers, repeat):
+    slices, size, dtype, syntax = case
+    name = f"{size}x{size}x{slices}:{dtype}:{syntax}"
+    folder = os.path.join(data_dir, name.replace(':', '_'))
+    result = {'case': name, 'slices': slices, 'matrix': size, 'dtype': dtype, 'transfer_syntax': syntax}
+    try:
+        start = time.perf_counter()
+        paths = write_series(folder, slices, size, dtype, syntax)
+        result['generate_seconds'] = time.perf_counter() - start
+        volume, result['load'] = bench_load(paths, workers)
+        result['window'] = bench_window(volume, repeat)
+        result['planes'] = bench_planes(volume, repeat)
+        result['render'] = bench_render(volume, repeat)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return result
+
+
+def environment():
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pydicom': pydicom.__version__,
+        'matplotlib': matplotlib.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DICOMビューアの性能ベンチマーク")
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--case', action='append', help="幅x高さxスライス数[:dtype[:転送構文]]（指定時はsuiteより優先）")
+    parser.add_argument('--repeat', type=int, default=20, help="各計測の繰り返し回数")
+    parser.add_argument('--workers', type=int, default=None, help="読み込みのワーカー数")
+    parser.add_argument('--data-dir', help="合成シリーズの作成先（既定: 一時フォルダ）")
+    parser.add_argument('-o', '--output', help="結果のJSONファイル（既定: 標準出力）")
+    args = parser.parse_args(argv)
+
+    cases = [parse_case(spec) for spec in args.case] if args.case else SUITES[args.suite]
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='dicom_bench_')
+    report = {'environment': environment(), 'repeat': args.repeat, 'results': []}
+    try:
+        for case in cases:
+            result = run_case(case, data_dir, args.workers, args.repeat)
+            report['results'].append(result)
+            status = result.get('error') or f"load {result['load']['seconds']:.2f}s"
+            print(f"{result['case']}: {status}", file=sys.stderr)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
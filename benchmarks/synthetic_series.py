@@ -0,0 +1,98 @@
+"""ベンチマーク用の合成DICOMシリーズを生成する"""
+import os
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import (CTImageStorage, ExplicitVRLittleEndian, ImplicitVRLittleEndian,
+                         RLELossless, generate_uid)
+
+TRANSFER_SYNTAXES = {
+    'explicit': ExplicitVRLittleEndian,
+    'implicit': ImplicitVRLittleEndian,
+    'rle': RLELossless,
+}
+
+DTYPES = {
+    'int16': (np.int16, 16, 1),
+    'uint16': (np.uint16, 16, 0),
+    'uint8': (np.uint8, 8, 0),
+}
+
+
+def phantom(slices, size, dtype):
+    """楕円の体幹と球状の構造物、ノイズを持つ (z, y, x) の合成ボリューム"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[-1:1:size * 1j, -1:1:size * 1j]
+    body = (x / 0.8) ** 2 + (y / 0.6) ** 2 <= 1
+    volume = np.empty((slices, size, size), dtype=np.float32)
+    for z in range(slices):
+        t = z / max(slices - 1, 1)
+        sphere = (x - 0.3 * np.cos(6 * t)) ** 2 + (y - 0.2) ** 2 <= (0.15 + 0.05 * np.sin(3 * t)) ** 2
+        volume[z] = np.where(body, 40.0, -1000.0) + np.where(sphere, 300.0, 0.0)
+    volume += rng.normal(0, 10, size=volume.shape[1:]).astype(np.float32)
+    info = np.iinfo(dtype)
+    if info.min == 0:
+        volume += 1024
+    return np.clip(volume, info.min, info.max).astype(dtype)
+
+
+def _save(ds, path):
+    try:
+        ds.save_as(path, enforce_file_format=True)
+    except TypeError:
+        # pydicom 2.x
+        ds.is_little_endian = True
+        ds.is_implicit_VR = ds.file_meta.TransferSyntaxUID == ImplicitVRLittleEndian
+        ds.save_as(path, write_like_original=False)
+
+
+def write_series(folder, slices=64, size=256, dtype='int16', syntax='explicit'):
+    """合成シリーズを folder に書き出し、ファイルパスの一覧を返す
+
+    ファイルはスライス順をシャッフルした名前で保存する（ソート処理も計測するため）。
+    """
+    os.makedirs(folder, exist_ok=True)
+    np_dtype, bits, signed = DTYPES[dtype]
+    volume = phantom(slices, size, np_dtype)
+    study_uid, series_uid = generate_uid(), generate_uid()
+    order = np.random.default_rng(1).permutation(slices)
+    paths = []
+    for name_index, z in enumerate(order):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = CTImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = 'CT'
+        ds.PatientName = 'Benchmark^Phantom'
+        ds.PatientID = 'BENCH'
+        ds.Rows = ds.Columns = size
+        ds.BitsAllocated = bits
+        ds.BitsStored = bits
+        ds.HighBit = bits - 1
+        ds.PixelRepresentation = signed
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.PixelSpacing = [0.7, 0.7]
+        ds.SliceThickness = 1.0
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.ImagePositionPatient = [0, 0, float(z)]
+        ds.InstanceNumber = int(z) + 1
+        ds.WindowWidth = 400
+        ds.WindowCenter = 40
+        pixels = volume[z]
+        if syntax == 'rle':
+            ds.compress(RLELossless, pixels)
+        else:
+            ds.PixelData = pixels.tobytes()
+            meta.TransferSyntaxUID = TRANSFER_SYNTAXES[syntax]
+        path = os.path.join(folder, f"IM{name_index:05d}.dcm")
+        _save(ds, path)
+        paths.append(path)
+    return paths
+
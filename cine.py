@@ -0,0 +1,149 @@
+"""スライスを一定のフレームレートで送るシネ再生"""
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+
+class CinePlayer:
+    """``root.after`` で目標FPSの時刻どおりにフレームを進めるループ
+
+    n 枚目のフレームは再生開始から n / fps 秒後に表示する。描画が
+    間に合わなかった場合はその時刻に表示すべきフレームまで飛ばし
+    （飛ばした数は ``skipped`` に数える）、再生が遅れ続けることはない。
+    ``show(位置)`` がフレームの表示、``prepare(次の期限)`` は表示後の
+    空き時間に先のフレームを用意するための呼び出し。
+    """
+
+    def __init__(self, root, show, prepare=None, history=240):
+        self.root = root
+        self.show = show
+        self.prepare = prepare
+        self.fps = 15
+        self.count = 0
+        self.skipped = 0
+        self.shown = 0
+        self._times = deque(maxlen=history)
+        self._pending = None
+        self._origin = 0.0
+        self._first = 0
+        self._frame = 0
+
+    @property
+    def playing(self):
+        return self._pending is not None
+
+    def start(self, count, position, fps):
+        """position から count 枚を繰り返し再生する"""
+        self.stop()
+        self.count = max(int(count), 1)
+        self.fps = fps
+        self.skipped = 0
+        self.shown = 0
+        self._times.clear()
+        self._rebase(position)
+        self._pending = self.root.after(1, self._tick)
+
+    def stop(self):
+        if self._pending is not None:
+            self.root.after_cancel(self._pending)
+            self._pending = None
+
+    def set_fps(self, fps):
+        """再生中でも現在の位置から新しいFPSで刻み直す"""
+        if fps == self.fps:
+            return
+        self.fps = fps
+        if self.playing:
+            self._rebase(self.position)
+
+    @property
+    def position(self):
+        return (self._first + self._frame) % self.count
+
+    def _rebase(self, position):
+        self._first = position
+        self._frame = 0
+        self._origin = time.perf_counter()
+
+    def _schedule(self, deadline):
+        wait = deadline - time.perf_counter()
+        self._pending = self.root.after(max(int(math.ceil(wait * 1000)), 1), self._tick)
+
+    def _tick(self):
+        self._pending = None
+        due = int((time.perf_counter() - self._origin) * self.fps)
+        if self.shown and due <= self._frame:
+            # 期限より早く起きた場合は待ち直す
+            self._schedule(self._origin + (self._frame + 1) / self.fps)
+            return
+        if self.shown:
+            self.skipped += due - self._frame - 1
+            self._frame = due
+        else:
+            # 先読みにかかった時間で最初のフレームを飛ばさないよう、表示した時点を起点にする
+            self._origin = time.perf_counter()
+        try:
+            self.show(self.position)
+        except Exception as e:
+            print(f"警告: シネ再生を停止しました: {e}")
+            return
+        self.shown += 1
+        self._times.append(time.perf_counter())
+        deadline = self._origin + (self._frame + 1) / self.fps
+        if self.prepare is not None:
+            self.prepare(deadline)
+        self._schedule(deadline)
+
+    def achieved_fps(self, window=1.0):
+        """直近 window 秒間に実際に表示したフレーム数/秒"""
+        if len(self._times) < 2:
+            return 0.0
+        now = time.perf_counter()
+        recent = [t for t in self._times if now - t <= window]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / (recent[-1] - recent[0])
+
+    def stats(self):
+        return {
+            'target_fps': self.fps,
+            'achieved_fps': self.achieved_fps(),
+            'shown': self.shown,
+            'skipped': self.skipped,
+        }
+
+
+class FrameRing:
+    """再生位置の先のウィンドウ処理済みフレームを保持する固定長のリングバッファ
+
+    位置 i のフレームはスロット i % capacity に入る。バッファは最初の
+    フレームの形で一度だけ確保し、以降はそこへ書き込む。``key`` が
+    変わったら（WW/WLや断面が変わったら）``reset()`` で捨てる。
+    """
+
+    def __init__(self, capacity=32):
+        self.capacity = capacity
+        self.key = None
+        self.frames = None
+        self.positions = [None] * capacity
+
+    def reset(self, key=None):
+        self.key = key
+        self.positions = [None] * self.capacity
+
+    def get(self, position):
+        slot = position % self.capacity
+        if self.positions[slot] != position:
+            return None
+        return self.frames[slot]
+
+    def put(self, position, image):
+        if self.frames is None or self.frames.shape[1:] != image.shape or self.frames.dtype != image.dtype:
+            self.frames = np.empty((self.capacity,) + image.shape, dtype=image.dtype)
+            self.positions = [None] * self.capacity
+        slot = position % self.capacity
+        np.copyto(self.frames[slot], image)
+        self.positions[slot] = position
+        return self.frames[slot]
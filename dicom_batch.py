@@ -0,0 +1,203 @@
+"""GUIを使わずにシリーズを読み込み、ウィンドウ処理したスライスを書き出す
+
+使い方の例::
+
+    python dicom_batch.py studies/ -o out/ --recursive --planes axial coronal \\
+        --indices middle --preset lung --preset 400,40 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dicom_loader import load_series
+from series_index import SeriesIndex
+from slice_cache import plane_size, plane_slice
+from windowing import WindowingEngine, header_window
+
+PLANES = {"axial": "Axial", "sagittal": "Sagittal", "coronal": "Coronal"}
+
+# CT値（RescaleSlope / RescaleIntercept を適用した値）での (WW, WL)
+PRESETS = {
+    'abdomen': (400, 40),
+    'lung': (1500, -600),
+    'mediastinum': (350, 50),
+    'bone': (2000, 500),
+    'brain': (80, 40),
+}
+
+
+def _series_names(name, series):
+    """同じ出力名の単位に複数のシリーズがあれば、シリーズ番号を付けて区別する"""
+    if len(series) == 1:
+        return [name]
+    names = []
+    for k, s in enumerate(series, 1):
+        label = f"S{s['series_number']}" if s['series_number'] is not None else str(k)
+        candidate = f"{name}_{label}"
+        if candidate in names:
+            candidate = f"{candidate}_{k}"
+        names.append(candidate)
+    return names
+
+
+def find_series(paths, recursive=False, index=None):
+    """入力パスのDICOMファイルをシリーズに分け、(ファイル一覧, 出力名) の一覧を作る
+
+    GUIと同じく ``SeriesIndex`` でヘッダを索引化し、StudyInstanceUID /
+    SeriesInstanceUID（さらにマトリクスと向き）ごとに分ける。拡張子の無い
+    DICOMファイルも対象になる。recursive の場合はさらにフォルダごとに分け、
+    出力名は入力パスからの相対パスを '_' でつないだものにする。
+    1つの出力名に複数のシリーズがあれば、出力名にシリーズ番号を付ける。
+    """
+    index = index or SeriesIndex()
+    result = []
+    for path in paths:
+        base = os.path.basename(os.path.normpath(path)) or 'series'
+        series = index.scan(path) or []
+        units = {}
+        for s in series:
+            if not recursive:
+                units.setdefault(base, []).append(s)
+                continue
+            by_folder = {}
+            for file_path in s['files']:
+                by_folder.setdefault(os.path.dirname(file_path), []).append(file_path)
+            for folder, files in by_folder.items():
+                rel = os.path.relpath(folder, os.path.abspath(path))
+                name = base if rel == '.' else f"{base}_{rel.replace(os.sep, '_')}"
+                units.setdefault(name, []).append(dict(s, files=files))
+        for name in sorted(units):
+            for s, series_name in zip(units[name], _series_names(name, units[name])):
+                result.append((s['files'], series_name))
+    return result
+
+
+def parse_indices(spec, count):
+    """'middle' / 'all' / 'every:N' / '0,10,20' をスライス番号の一覧にする"""
+    if spec == 'middle':
+        return [count // 2]
+    if spec == 'all':
+        return list(range(count))
+    if spec.startswith('every:'):
+        return list(range(0, count, max(int(spec.split(':', 1)[1]), 1)))
+    return [i for i in (int(v) for v in spec.split(',') if v.strip()) if 0 <= i < count]
+
+
+def parse_preset(spec):
+    """プリセット名または 'WW,WL' を (名前, WW, WL) にする（'header' はヘッダ値）"""
+    if spec == 'header':
+        return spec, None, None
+    if spec in PRESETS:
+        ww, wl = PRESETS[spec]
+        return spec, ww, wl
+    ww, wl = (int(float(v)) for v in spec.split(','))
+    return f"w{ww}_l{wl}", ww, wl
+
+
+def resolve_window(volume, dicom_data, ww, wl):
+    """'header' プリセットの値を決める（ヘッダに無ければ1〜99パーセンタイルから）"""
+    if ww is not None:
+        return ww, wl
+    window = header_window(dicom_data)
+    if window is not None:
+        return window
+    return volume.stats.auto_window(1.0, 99.0)
+
+
+def write_image(path, image, fmt):
+    if fmt == 'raw':
+        np.ascontiguousarray(image).tofile(path)
+        return
+    from PIL import Image
+    Image.fromarray(np.ascontiguousarray(image)).save(path)
+
+
+def render_series(volume, dicom_data, planes, index_spec, presets, windowing=None):
+    """(断面, 番号, プリセット名, uint8画像) を順に返す"""
+    windowing = windowing or WindowingEngine()
+    for name, ww, wl in presets:
+        ww, wl = resolve_window(volume, dicom_data, ww, wl)
+        for plane in planes:
+            for index in parse_indices(index_spec, plane_size(volume.shape, plane)):
+                image = windowing.apply(plane_slice(volume, plane, index), ww, wl, rescale=volume.rescale,
+                                        value_range=volume.stats.stored_range())
+                yield plane, index, name, image
+
+
+def process_series(job):
+    """1シリーズを処理する（プロセスプールから呼ばれる）"""
+    file_paths, name, output_dir, planes, index_spec, presets, fmt, load_workers = job
+    start = time.perf_counter()
+    result = {'series': name, 'images': 0, 'slices': 0, 'error': None}
+    try:
+        volume, dicom_data = load_series(file_paths, max_workers=load_workers)
+        result['slices'] = volume.shape[0]
+        series_dir = os.path.join(output_dir, name)
+        os.makedirs(series_dir, exist_ok=True)
+        for plane, index, preset, image in render_series(volume, dicom_data, planes, index_spec, presets):
+            filename = f"{plane.lower()}_{index:04d}_{preset}"
+            if fmt == 'raw':
+                # rawは形状が分からないので 幅x高さ をファイル名に入れる
+                filename += f"_{image.shape[1]}x{image.shape[0]}"
+            filename += f".{fmt}"
+            write_image(os.path.join(series_dir, filename), image, fmt)
+            result['images'] += 1
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(series, output_dir, planes=("Axial",), index_spec='middle', presets=(('header', None, None),),
+              fmt='png', workers=None, load_workers=1):
+    """複数シリーズをプロセス並列で処理し、(結果一覧, 経過秒) を返す
+
+    series は find_series() が返す (ファイル一覧, 出力名) の一覧。
+    """
+    jobs = [(tuple(files), name, output_dir, tuple(planes), index_spec, tuple(presets), fmt, load_workers)
+            for files, name in series]
+    start = time.perf_counter()
+    if workers == 1:
+        results = [process_series(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(process_series, jobs))
+    return results, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DICOMシリーズのスライス画像を一括出力します")
+    parser.add_argument('inputs', nargs='+', help="シリーズのフォルダ（--recursive なら親フォルダ）")
+    parser.add_argument('-o', '--output', required=True, help="出力先フォルダ")
+    parser.add_argument('--recursive', action='store_true', help="フォルダごとにシリーズを分けて出力する")
+    parser.add_argument('--planes', nargs='+', choices=sorted(PLANES), default=['axial'])
+    parser.add_argument('--indices', default='middle', help="middle / all / every:N / 0,10,20")
+    parser.add_argument('--preset', action='append', dest='presets',
+                        help=f"header / {' / '.join(sorted(PRESETS))} / WW,WL（複数指定可）")
+    parser.add_argument('--format', choices=['png', 'raw'], default='png')
+    parser.add_argument('--workers', type=int, default=None, help="並列プロセス数（既定: CPU数）")
+    args = parser.parse_args(argv)
+
+    series = find_series(args.inputs, args.recursive)
+    presets = [parse_preset(p) for p in (args.presets or ['header'])]
+    planes = [PLANES[p] for p in args.planes]
+    results, elapsed = run_batch(series, args.output, planes, args.indices, presets,
+                                 args.format, args.workers)
+    failed = 0
+    for result in results:
+        if result['error']:
+            failed += 1
+            print(f"失敗: {result['series']}: {result['error']}", file=sys.stderr)
+        else:
+            print(f"{result['series']}: {result['slices']}スライス, {result['images']}枚 ({result['seconds']:.2f}秒)")
+    rate = len(results) / elapsed if elapsed > 0 else 0.0
+    print(f"{len(results)}シリーズ / {elapsed:.2f}秒 ({rate:.2f} シリーズ/秒), 失敗 {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
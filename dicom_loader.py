@@ -0,0 +1,331 @@
+"""DICOMシリーズの読み込み（ヘッダ先行・並列デコード）"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
+import numpy as np
+import pydicom
+
+from dicom_volume import DicomVolume, pixel_dtype
+from frame_decoder import decode_frames, frame_chunks, ordered_map
+from mpr import VolumeGeometry, functional_value
+
+
+def default_worker_count():
+    """デコードに使うワーカー数の既定値"""
+    return min(8, os.cpu_count() or 1)
+
+
+def is_dicom_file(path):
+    """拡張子 .dcm か、128バイトのプリアンブルの後に 'DICM' があるファイルか"""
+    if path.lower().endswith('.dcm'):
+        return True
+    try:
+        with open(path, 'rb') as f:
+            return f.read(132)[128:] == b'DICM'
+    except OSError:
+        return False
+
+
+def read_header(file_path):
+    """画素データを読まずにヘッダのみを読み込む"""
+    return pydicom.dcmread(file_path, stop_before_pixels=True)
+
+
+def slice_position(ds, default):
+    """スライスの並び順に使う位置を返す（画像の法線方向への ImagePositionPatient の射影）"""
+    if hasattr(ds, 'ImagePositionPatient'):
+        position = [float(v) for v in ds.ImagePositionPatient]
+        orientation = getattr(ds, 'ImageOrientationPatient', None)
+        if orientation is not None and len(orientation) == 6:
+            values = [float(v) for v in orientation]
+            return float(np.dot(position, np.cross(values[:3], values[3:])))
+        return position[2]
+    if hasattr(ds, 'SliceLocation'):
+        return float(ds.SliceLocation)
+    return default
+
+
+def frame_count(ds):
+    """ファイルに含まれるフレーム数"""
+    try:
+        return max(int(getattr(ds, 'NumberOfFrames', 1) or 1), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def header_rescale(ds, frame=0):
+    """(RescaleSlope, RescaleIntercept) を返す（無ければ (1, 0)、拡張マルチフレームはフレームごと）
+
+    傾きが正かどうかは確かめない（シリーズ単位で SeriesLoader が扱う）。
+    """
+    values = []
+    for keyword, default in (('RescaleSlope', 1.0), ('RescaleIntercept', 0.0)):
+        try:
+            value = float(functional_value(ds, 'PixelValueTransformationSequence', keyword, frame))
+        except (TypeError, ValueError):
+            value = default
+        values.append(value)
+    return tuple(values)
+
+
+def frame_rescales(ds, count):
+    """ファイルの各フレームの (傾き, 切片) を (count, 2) の配列で返す"""
+    if count > 1 and getattr(ds, 'PerFrameFunctionalGroupsSequence', None):
+        return np.array([header_rescale(ds, k) for k in range(count)])
+    return np.tile(header_rescale(ds), (count, 1))
+
+
+def stored_range(ds, dtype):
+    """BitsStored と PixelRepresentation から格納値の範囲 (最小, 最大) を求める"""
+    dtype = np.dtype(dtype)
+    info = np.iinfo(dtype)
+    try:
+        bits = int(getattr(ds, 'BitsStored', 0) or 0)
+    except (TypeError, ValueError):
+        bits = 0
+    if not 0 < bits < 8 * dtype.itemsize:
+        return int(info.min), int(info.max)
+    if dtype.kind == 'i':
+        return -2 ** (bits - 1), 2 ** (bits - 1) - 1
+    return 0, 2 ** bits - 1
+
+
+def common_rescale(rescales, dtype, value_range):
+    """スライスごとの (傾き, 切片) をまとめる共通の (傾き, 切片, 格納dtype) を選ぶ
+
+    傾きは最も細かいものを使い、value_range（格納値の範囲）の値が全スライスで
+    収まるように切片と格納dtypeを決める。元のdtypeに収まらなければ int32
+    （表示は WindowingEngine がデコード済みの値の範囲だけのLUTで行う）、
+    それでも収まらなければ float32 で保持する。整数で保持する場合、傾きが
+    共通の傾きの整数倍でないスライスは共通の傾きの半分以内で丸められる。
+    """
+    slope = float(rescales[:, 0].min())
+    low, high = value_range
+    real_low = float((low * rescales[:, 0] + rescales[:, 1]).min())
+    real_high = float((high * rescales[:, 0] + rescales[:, 1]).max())
+    preferred = float(rescales[:, 1].min())
+    for candidate in (np.dtype(dtype), np.dtype(np.int32)):
+        info = np.iinfo(candidate)
+        if (real_high - real_low) / slope > int(info.max) - int(info.min):
+            continue
+        intercept = preferred
+        if (real_low - intercept) / slope < info.min or (real_high - intercept) / slope > info.max:
+            # 最小の値が dtype の最小値になるように切片をずらす
+            intercept = real_low - int(info.min) * slope
+        return slope, intercept, candidate
+    return slope, preferred, np.dtype(np.float32)
+
+
+def normalize_frames(frames, rescales, rescale, dtype):
+    """(n, y, x) のフレームを、フレームごとの rescales から共通の rescale の格納値へ変換する
+
+    全フレームをまとめて1回のベクトル演算で変換する。common_rescale() で選んだ
+    dtype には BitsStored の範囲の値がすべて収まる（範囲外の不正な値だけ飽和させる）。
+    """
+    slope, intercept = rescale
+    scale = (rescales[:, 0] / slope)[:, np.newaxis, np.newaxis]
+    offset = ((rescales[:, 1] - intercept) / slope)[:, np.newaxis, np.newaxis]
+    values = frames * scale
+    values += offset
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        np.rint(values, out=values)
+        info = np.iinfo(dtype)
+        np.clip(values, info.min, info.max, out=values)
+    return values.astype(dtype)
+
+
+class SeriesLoader:
+    """ヘッダでスライス順を決めてから、画素データを並列デコードする
+
+    デコード結果は事前に確保した ``DicomVolume`` へ各ワーカーが直接書き込む。
+    マルチフレームのファイルは数フレームずつの供給元に分け、フレーム単位で
+    デコードする（圧縮された大きなマルチフレームでも必要な分だけ読む）。
+    画素は格納時の整数dtypeのまま保持し、RescaleSlope / RescaleIntercept は
+    ``volume.rescale`` として表示側で適用する。スライスによって値が異なる
+    シリーズは、全スライスの値が収まる共通の値と格納dtype（必要なら int32 など
+    に広げる）を選び、デコード時にその格納値へ変換して揃える。
+    ``run()`` は別スレッドで実行し、UI側は ``progress()`` と ``done()`` を
+    ポーリングするだけでよい。デコードは中央のスライスから外側へ向かう順に
+    行うので、``volume`` が確保された時点で中央付近から表示できる。
+    ``lazy=True`` の場合はデコードを行わず、
+    スライスはアクセスされた時点でデコードされる。ボリュームが
+    ``memmap_threshold`` バイトを超える場合は一時ファイル上に確保する。
+    ``profiler`` を渡すと各段階（load.header / load.sort / load.allocate /
+    load.decode、ファイルごとの load.decode_file）の所要時間を記録する。
+    """
+
+    HEADER_WEIGHT = 0.2
+
+    def __init__(self, file_paths, max_workers=None, lazy=False, memmap_threshold=None, cache_dir=None,
+                 profiler=None):
+        self.file_paths = list(file_paths)
+        self.max_workers = max_workers or default_worker_count()
+        self.lazy = lazy
+        self.memmap_threshold = memmap_threshold
+        self.cache_dir = cache_dir
+        self.profiler = profiler
+        self.slices = []  # (位置, パス, ヘッダ, 開始インデックス, フレーム数)
+        self.rescales = None  # スライスごとの (傾き, 切片)
+        self.rescale = (1.0, 0.0)
+        self._normalize = False
+        self.volume = None
+        self.dicom_data = None
+        self.error = None
+        self.phase = "header"
+        self._lock = threading.Lock()
+        self._headers_done = 0
+        self._frames_done = 0
+        self._frames_total = 0
+        self._finished = threading.Event()
+        self._cancelled = threading.Event()
+
+    def run(self):
+        """ヘッダ読み込み → ソート → 確保 → 並列デコードを実行する"""
+        try:
+            with self._measure("load.total"), ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                self._read_headers(executor)
+                with self._measure("load.allocate"):
+                    self._allocate()
+                if self.volume is not None and not self.lazy:
+                    with self._measure("load.decode"):
+                        self._decode(executor)
+            self.phase = "done"
+        except Exception as e:
+            self.error = e
+            self.phase = "error"
+        finally:
+            self._finished.set()
+
+    def done(self):
+        return self._finished.is_set()
+
+    def cancel(self):
+        """未処理のデコードを打ち切る
+
+        打ち切ったスライスも供給元は残るので、アクセスされればデコードできる。
+        """
+        self._cancelled.set()
+
+    def progress(self):
+        """進捗を0〜1で返す（どのスレッドからでも呼べる）"""
+        with self._lock:
+            if self.phase == "header":
+                return self.HEADER_WEIGHT * self._headers_done / max(len(self.file_paths), 1)
+            if self._frames_total == 0:
+                return 1.0
+            return self.HEADER_WEIGHT + (1 - self.HEADER_WEIGHT) * self._frames_done / self._frames_total
+
+    def _measure(self, stage):
+        return self.profiler.measure(stage) if self.profiler is not None else nullcontext()
+
+    @property
+    def slice_count(self):
+        return self._frames_total
+
+    def _read_one_header(self, item):
+        idx, file_path = item
+        try:
+            ds = read_header(file_path)
+        except Exception as e:
+            print(f"警告: {file_path} の読み込みに失敗しました: {e}")
+            ds = None
+        with self._lock:
+            self._headers_done += 1
+        return idx, file_path, ds
+
+    def _read_headers(self, executor):
+        headers = []
+        with self._measure("load.header"):
+            for idx, file_path, ds in executor.map(self._read_one_header, enumerate(self.file_paths)):
+                if ds is not None:
+                    headers.append((slice_position(ds, idx), file_path, ds))
+        with self._measure("load.sort"):
+            headers.sort(key=lambda x: x[0])
+        start = 0
+        for position, file_path, ds in headers:
+            n = frame_count(ds)
+            self.slices.append((position, file_path, ds, start, n))
+            start += n
+        with self._lock:
+            self._frames_total = start
+            self.phase = "decode"
+
+    def _allocate(self):
+        if not self.slices:
+            return
+        first = self.slices[0][2]
+        rows, cols = int(first.Rows), int(first.Columns)
+        for _, file_path, ds, _, _ in self.slices:
+            if (int(ds.Rows), int(ds.Columns)) != (rows, cols):
+                raise ValueError(f"画像サイズが一致しません: {os.path.basename(file_path)}")
+        shape = (self._frames_total, rows, cols)
+        dtype = pixel_dtype(first)
+        self.rescales = np.concatenate([frame_rescales(ds, n) for _, _, ds, _, n in self.slices])
+        invalid = self.rescales[:, 0] <= 0
+        if invalid.any():
+            # 警告はフレームごとではなくシリーズにつき1回だけ出す
+            slopes = ", ".join(f"{v:g}" for v in np.unique(self.rescales[invalid, 0]))
+            print(f"警告: RescaleSlope {slopes} は使用できないため 1 として扱います（{int(invalid.sum())} フレーム）")
+            self.rescales[invalid, 0] = 1.0
+        slope, intercept, dtype = common_rescale(self.rescales, dtype, stored_range(first, dtype))
+        self.rescale = (slope, intercept)
+        self._normalize = bool((self.rescales != self.rescale).any())
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        use_memmap = self.memmap_threshold is not None and nbytes > self.memmap_threshold
+        volume = DicomVolume(shape, dtype, cache_dir=self.cache_dir, use_memmap=use_memmap)
+        for _, file_path, _, start, n in self.slices:
+            for frame, count in frame_chunks(n):
+                decode = partial(self._decode_frames, file_path, frame, count, n, start + frame)
+                volume.add_source(start + frame, count, decode)
+        try:
+            volume.geometry = VolumeGeometry.from_headers([(ds, n) for _, _, ds, _, n in self.slices], shape)
+        except Exception as e:
+            print(f"警告: スライスの位置情報を読み取れませんでした: {e}")
+            volume.geometry = VolumeGeometry.from_dataset(first, shape)
+        volume.rescale = self.rescale
+        volume.slice_rescale = self.rescales
+        self.dicom_data = first
+        # 供給元を登録し終えてから公開する（UIスレッドが参照するため）
+        self.volume = volume
+
+    def _decode_frames(self, file_path, first, count, total, start_index):
+        start = time.perf_counter()
+        # ファイル全体が1つの供給元ならまとめてデコードする
+        frames = decode_frames(file_path, first, count if count < total else None)
+        if self.profiler is not None:
+            self.profiler.record("load.decode_file", time.perf_counter() - start, start)
+        if frames is None or frames.shape != (count,) + self.volume.shape[1:]:
+            shape = None if frames is None else frames.shape
+            raise ValueError(f"画素データの形状が不正です: {os.path.basename(file_path)} {shape}")
+        if self._normalize:
+            frames = normalize_frames(frames, self.rescales[start_index:start_index + count], self.rescale,
+                                      self.volume.dtype)
+        with self._lock:
+            self._frames_done += count
+        return frames
+
+    def _decode(self, executor):
+        middle = self.volume.shape[0] // 2
+        spans = [self.volume.source_span(index) for index in range(self.volume.source_count)]
+        order = sorted(range(len(spans)),
+                       key=lambda index: max(spans[index][0] - middle, middle - (sum(spans[index]) - 1), 0))
+        # 処理中の供給元を制限し、中央に近い順に書き込む
+        for _ in ordered_map(executor, self.volume.load_source, order, self.max_workers * 2,
+                             cancelled=self._cancelled):
+            pass
+
+
+def load_series(file_paths, max_workers=None, profiler=None):
+    """シリーズを同期的に読み込み (DicomVolume, ヘッダ) を返す（GUI不要）"""
+    loader = SeriesLoader(file_paths, max_workers=max_workers, profiler=profiler)
+    loader.run()
+    if loader.error is not None:
+        raise loader.error
+    if loader.volume is None:
+        raise ValueError("有効なDICOMファイルが見つかりませんでした")
+    return loader.volume, loader.dicom_data
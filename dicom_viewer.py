@@ -4,8 +4,24 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
-import pydicom
+from matplotlib.transforms import Bbox
 import os
+import math
+import threading
+import time
+
+from dicom_loader import SeriesLoader, default_worker_count
+from series_cache import SeriesCache
+from series_index import SeriesIndex
+from windowing import WindowingEngine, header_window
+from redraw_scheduler import RedrawScheduler
+from slice_cache import SliceCache, SlicePrefetcher, plane_size, plane_slice
+from pyramid import choose_level
+from profiling import Profiler
+from volume_stats import AUTO_WINDOW_PRESETS
+from mpr import Reslicer, VolumeGeometry
+from slab import SLAB_MODES, plane_projector
+from cine import CinePlayer, FrameRing
 
 plt.rcParams['font.sans-serif'] = ['MS Gothic', 'Yu Gothic', 'Meiryo', 'DejaVu Sans']
 plt.rcParams['axes.unicode_minus'] = False
@@ -22,6 +38,47 @@ class DICOMViewer:
         self.window_width = 400
         self.window_level = 40
         self.view_mode = "Sagittal"
+        self.load_workers = default_worker_count()
+        self.lazy_decode = False
+        self.memmap_threshold = 512 * 1024 * 1024
+        self.series_cache = SeriesCache()
+        self.series_index = SeriesIndex()
+        self.windowing = WindowingEngine()
+        self.slice_cache = SliceCache()
+        self.prefetcher = SlicePrefetcher(self.slice_cache, self.apply_window)
+        self.volume_generation = 0
+        self.scroll_directions = {"Axial": 1, "Sagittal": 1, "Coronal": 1}
+        self.plane_copy_max_bytes = 2 * 1024 * 1024 * 1024
+        self.pyramid_min_matrix = 1024
+        self.refine_delay_ms = 250
+        self.refine_timer = None
+        self.interacting = False
+        self.streaming_load = True
+        self.streaming = False
+        self.active_loader = None  # 最後に開始した読み込み
+        self.shown_loader = None  # 表示中でまだデコード中のボリュームの読み込み
+        self.active_scan = None
+        self.artists = None
+        self.backgrounds = None
+        self.panel_keys = {}
+        self.profiler = Profiler()
+        self.auto_window_range = (1.0, 99.0)
+        self.histogram_state = None
+        self.histogram_range = None
+        self.estimated_window = None
+        self.reslicer = None
+        self.oblique_angle = 0
+        self.oblique_tilt = 0
+        self.dragging_oblique = False
+        self.slab_mode = "なし"
+        self.slab_thickness = 10
+        self.slab_projectors = {}
+        self.overlay_stages = ("display.extract", "display.window", "display.artists", "display.draw")
+        self.redraw_scheduler = RedrawScheduler(self.root, self.update_display)
+        self.cine = CinePlayer(self.root, self.show_cine_frame, self.fill_cine_ring)
+        self.cine_ring = FrameRing()
+        self.cine_panel = None
+        self.cine_fill_cost = 0.0
         self.setup_ui()
         self.show_welcome_message()
         self.root.after(500, self.load_dicom_folder)
@@ -36,10 +93,26 @@ class DICOMViewer:
         file_menu.add_command(label="DICOMフォルダを開く", command=self.load_dicom_folder, accelerator="Ctrl+D")
         file_menu.add_separator()
         file_menu.add_command(label="終了", command=self.root.quit, accelerator="Ctrl+Q")
+        view_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="表示", menu=view_menu)
+        self.plane_copies_var = tk.BooleanVar(value=False)
+        view_menu.add_checkbutton(label="断面の高速化コピーを作成（メモリ使用量増）", variable=self.plane_copies_var,
+                                  command=self.toggle_plane_copies)
+        view_menu.add_separator()
+        view_menu.add_command(label="描画統計", command=self.show_render_stats)
+        self.overlay_var = tk.BooleanVar(value=False)
+        view_menu.add_checkbutton(label="FPS・遅延を画像上に表示", variable=self.overlay_var,
+                                  command=self.toggle_overlay)
+        view_menu.add_command(label="プロファイルを保存...", command=self.save_profile)
+        view_menu.add_command(label="プロファイルをリセット", command=self.reset_profile)
         self.root.bind('<Control-o>', lambda e: self.load_dicom())
         self.root.bind('<Control-Shift-O>', lambda e: self.load_multiple_dicom())
         self.root.bind('<Control-d>', lambda e: self.load_dicom_folder())
         self.root.bind('<Control-q>', lambda e: self.root.quit())
+        self.root.bind('<Up>', lambda e: self.on_arrow_key(e, 'axial', 1))
+        self.root.bind('<Down>', lambda e: self.on_arrow_key(e, 'axial', -1))
+        self.root.bind('<Right>', lambda e: self.on_arrow_key(e, 'other', 1))
+        self.root.bind('<Left>', lambda e: self.on_arrow_key(e, 'other', -1))
         main_frame = ttk.Frame(self.root, padding="5")
         main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         self.root.columnconfigure(0, weight=1)
@@ -84,37 +157,84 @@ class DICOMViewer:
         self.ax2.axis('off')
         self.canvas = FigureCanvasTkAgg(self.fig, master=image_frame)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
+        self.canvas.mpl_connect('resize_event', lambda e: self.fig.tight_layout())
+        self.canvas.mpl_connect('scroll_event', self.on_image_scroll)
+        self.canvas.mpl_connect('button_press_event', self.on_image_press)
+        self.canvas.mpl_connect('motion_notify_event', self.on_image_drag)
+        self.canvas.mpl_connect('button_release_event', self.on_image_release)
         control_frame = ttk.LabelFrame(control_bottom_frame, text="画像調整", padding="10")
         control_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         ttk.Label(control_frame, text="Axial スライス:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
         self.slice_axial_var = tk.IntVar(value=0)
-        self.slice_axial_slider = ttk.Scale(control_frame, from_=0, to=0, variable=self.slice_axial_var, orient=tk.HORIZONTAL, command=self.update_display, length=400)
+        self.slice_axial_slider = ttk.Scale(control_frame, from_=0, to=0, variable=self.slice_axial_var, orient=tk.HORIZONTAL, command=self.request_redraw, length=400)
         self.slice_axial_slider.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
         self.slice_axial_label = ttk.Label(control_frame, text="0/0", width=12, font=('Arial', 10))
         self.slice_axial_label.grid(row=0, column=2, padx=5, pady=5)
         ttk.Label(control_frame, text="表示モード:").grid(row=0, column=3, sticky=tk.W, padx=(20, 5), pady=5)
         self.view_mode_var = tk.StringVar(value="Sagittal")
-        view_mode_combo = ttk.Combobox(control_frame, textvariable=self.view_mode_var, values=["Sagittal", "Coronal"], state="readonly", width=15)
+        view_mode_combo = ttk.Combobox(control_frame, textvariable=self.view_mode_var, values=["Sagittal", "Coronal", "Oblique"], state="readonly", width=15)
         view_mode_combo.grid(row=0, column=4, sticky=tk.W, padx=5, pady=5)
         view_mode_combo.bind("<<ComboboxSelected>>", self.change_view_mode)
         ttk.Label(control_frame, text="スライス:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
         self.slice_other_var = tk.IntVar(value=0)
-        self.slice_other_slider = ttk.Scale(control_frame, from_=0, to=0, variable=self.slice_other_var, orient=tk.HORIZONTAL, command=self.update_display, length=400)
+        self.slice_other_slider = ttk.Scale(control_frame, from_=0, to=0, variable=self.slice_other_var, orient=tk.HORIZONTAL, command=self.request_redraw, length=400)
         self.slice_other_slider.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
         self.slice_other_label = ttk.Label(control_frame, text="0/0", width=12, font=('Arial', 10))
         self.slice_other_label.grid(row=1, column=2, padx=5, pady=5)
         ttk.Label(control_frame, text="Window Width:").grid(row=1, column=3, sticky=tk.W, padx=(20, 5), pady=5)
         self.ww_var = tk.IntVar(value=400)
-        self.ww_slider = ttk.Scale(control_frame, from_=1, to=2000, variable=self.ww_var, orient=tk.HORIZONTAL, command=self.update_display, length=250)
+        self.ww_slider = ttk.Scale(control_frame, from_=1, to=2000, variable=self.ww_var, orient=tk.HORIZONTAL, command=self.request_redraw, length=250)
         self.ww_slider.grid(row=1, column=4, sticky=(tk.W, tk.E), padx=5, pady=5)
         self.ww_label = ttk.Label(control_frame, text="400", width=8, font=('Arial', 10))
         self.ww_label.grid(row=1, column=5, padx=5, pady=5)
         ttk.Label(control_frame, text="Window Level:").grid(row=1, column=6, sticky=tk.W, padx=(20, 5), pady=5)
         self.wl_var = tk.IntVar(value=40)
-        self.wl_slider = ttk.Scale(control_frame, from_=-1000, to=1000, variable=self.wl_var, orient=tk.HORIZONTAL, command=self.update_display, length=250)
+        self.wl_slider = ttk.Scale(control_frame, from_=-1000, to=1000, variable=self.wl_var, orient=tk.HORIZONTAL, command=self.request_redraw, length=250)
         self.wl_slider.grid(row=1, column=7, sticky=(tk.W, tk.E), padx=5, pady=5)
         self.wl_label = ttk.Label(control_frame, text="40", width=8, font=('Arial', 10))
         self.wl_label.grid(row=1, column=8, padx=5, pady=5)
+        ttk.Label(control_frame, text="自動ウィンドウ:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
+        auto_frame = ttk.Frame(control_frame)
+        auto_frame.grid(row=2, column=1, sticky=tk.W, padx=5, pady=5)
+        for name, low, high in AUTO_WINDOW_PRESETS:
+            ttk.Button(auto_frame, text=name, command=lambda low=low, high=high: self.apply_auto_window(low, high)).pack(side=tk.LEFT, padx=2)
+        self.histogram_canvas = tk.Canvas(control_frame, height=60, bg='#1a1a1a', highlightthickness=0)
+        self.histogram_canvas.grid(row=2, column=3, columnspan=6, sticky=(tk.W, tk.E), padx=5, pady=5)
+        self.histogram_canvas.bind('<Configure>', lambda e: self.draw_histogram(force=True))
+        ttk.Label(control_frame, text="斜断面 角度:").grid(row=3, column=0, sticky=tk.W, padx=5, pady=5)
+        self.oblique_angle_var = tk.IntVar(value=0)
+        ttk.Scale(control_frame, from_=-90, to=90, variable=self.oblique_angle_var, orient=tk.HORIZONTAL, command=self.request_redraw, length=400).grid(row=3, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+        self.oblique_angle_label = ttk.Label(control_frame, text="0°", width=12, font=('Arial', 10))
+        self.oblique_angle_label.grid(row=3, column=2, padx=5, pady=5)
+        ttk.Label(control_frame, text="傾き:").grid(row=3, column=3, sticky=tk.W, padx=(20, 5), pady=5)
+        self.oblique_tilt_var = tk.IntVar(value=0)
+        ttk.Scale(control_frame, from_=-60, to=60, variable=self.oblique_tilt_var, orient=tk.HORIZONTAL, command=self.request_redraw, length=250).grid(row=3, column=4, sticky=(tk.W, tk.E), padx=5, pady=5)
+        self.oblique_tilt_label = ttk.Label(control_frame, text="0°", width=8, font=('Arial', 10))
+        self.oblique_tilt_label.grid(row=3, column=5, padx=5, pady=5)
+        ttk.Label(control_frame, text="スラブ投影:").grid(row=4, column=0, sticky=tk.W, padx=5, pady=5)
+        self.slab_mode_var = tk.StringVar(value=self.slab_mode)
+        slab_mode_combo = ttk.Combobox(control_frame, textvariable=self.slab_mode_var, values=["なし"] + list(SLAB_MODES), state="readonly", width=15)
+        slab_mode_combo.grid(row=4, column=1, sticky=tk.W, padx=5, pady=5)
+        slab_mode_combo.bind("<<ComboboxSelected>>", self.change_slab_mode)
+        ttk.Label(control_frame, text="スラブ厚:").grid(row=4, column=3, sticky=tk.W, padx=(20, 5), pady=5)
+        self.slab_thickness_var = tk.IntVar(value=self.slab_thickness)
+        ttk.Scale(control_frame, from_=1, to=100, variable=self.slab_thickness_var, orient=tk.HORIZONTAL, command=self.request_redraw, length=250).grid(row=4, column=4, sticky=(tk.W, tk.E), padx=5, pady=5)
+        self.slab_thickness_label = ttk.Label(control_frame, text=f"{self.slab_thickness} mm", width=8, font=('Arial', 10))
+        self.slab_thickness_label.grid(row=4, column=5, padx=5, pady=5)
+        ttk.Label(control_frame, text="シネ再生:").grid(row=5, column=0, sticky=tk.W, padx=5, pady=5)
+        cine_frame = ttk.Frame(control_frame)
+        cine_frame.grid(row=5, column=1, sticky=tk.W, padx=5, pady=5)
+        ttk.Button(cine_frame, text="▶ Axial", command=lambda: self.toggle_cine('axial')).pack(side=tk.LEFT, padx=2)
+        ttk.Button(cine_frame, text="▶ 右の断面", command=lambda: self.toggle_cine('other')).pack(side=tk.LEFT, padx=2)
+        ttk.Button(cine_frame, text="■ 停止", command=self.stop_cine).pack(side=tk.LEFT, padx=2)
+        ttk.Label(control_frame, text="FPS:").grid(row=5, column=3, sticky=tk.W, padx=(20, 5), pady=5)
+        self.cine_fps_var = tk.IntVar(value=15)
+        ttk.Scale(control_frame, from_=1, to=60, variable=self.cine_fps_var, orient=tk.HORIZONTAL, command=self.change_cine_fps, length=250).grid(row=5, column=4, sticky=(tk.W, tk.E), padx=5, pady=5)
+        self.cine_fps_label = ttk.Label(control_frame, text="15", width=8, font=('Arial', 10))
+        self.cine_fps_label.grid(row=5, column=5, padx=5, pady=5)
+        self.cine_status_label = ttk.Label(control_frame, text="停止中", font=('Arial', 10))
+        self.cine_status_label.grid(row=5, column=6, columnspan=3, sticky=tk.W, padx=(20, 5), pady=5)
         control_frame.columnconfigure(1, weight=2)
         control_frame.columnconfigure(4, weight=1)
         control_frame.columnconfigure(7, weight=1)
@@ -161,6 +281,9 @@ class DICOMViewer:
         patient_frame.columnconfigure(1, weight=1)
 
     def show_welcome_message(self):
+        self.artists = None
+        self.backgrounds = None
+        self.panel_keys = {}
         self.ax1.clear()
         self.ax2.clear()
         self.ax1.text(0.5, 0.5, 'DICOM画像ビューア\n\nファイルを開いてください', 
@@ -186,38 +309,9 @@ class DICOMViewer:
             if self.volume is None:
                 self.show_welcome_message()
             return
-        try:
-            self.dicom_data = pydicom.dcmread(file_path)
-            pixel_array = self.dicom_data.pixel_array
-            if len(pixel_array.shape) == 2:
-                self.volume = np.stack([pixel_array] * 10, axis=0)
-                messagebox.showinfo("情報", "単一スライスのDICOMファイルです。\n表示のため10枚に複製しました。")
-            else:
-                self.volume = pixel_array
-            self.volume = self.volume.astype(np.float32)
-            self.slice_axial_slider.config(to=self.volume.shape[0] - 1)
-            self.current_slice_axial = self.volume.shape[0] // 2
-            self.slice_axial_var.set(self.current_slice_axial)
-            self.update_slice_range()
-            if hasattr(self.dicom_data, 'WindowWidth') and hasattr(self.dicom_data, 'WindowCenter'):
-                self.window_width = int(self.dicom_data.WindowWidth)
-                self.window_level = int(self.dicom_data.WindowCenter)
-            else:
-                self.window_width = int(np.ptp(self.volume))
-                self.window_level = int(np.mean(self.volume))
-            self.ww_var.set(self.window_width)
-            self.wl_var.set(self.window_level)
-            
-            # 画像情報を更新
-            self.update_image_info()
-            
-            self.update_display()
-            filename = os.path.basename(file_path)
-            self.file_label.config(text=f"ファイル: {filename}", foreground="green")
-            messagebox.showinfo("成功", f"DICOMファイルを読み込みました\n形状: {self.volume.shape}")
-        except Exception as e:
-            messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました:\n{str(e)}")
-    
+        # マルチフレームもフレーム単位でバックグラウンドデコードし、単一画像は2Dのまま表示する
+        self.load_dicom_files([file_path])
+
     def load_multiple_dicom(self):
         """複数のDICOMファイルを読み込む"""
         file_paths = filedialog.askopenfilenames(
@@ -232,7 +326,11 @@ class DICOMViewer:
         self.load_dicom_files(file_paths)
 
     def load_dicom_folder(self):
-        """フォルダ内のすべてのDICOMファイルを読み込む"""
+        """フォルダを索引化し、シリーズを選んで読み込む
+
+        ヘッダの索引化はバックグラウンドで行い、前回から変更の無いファイルは
+        読み直さない。シリーズが複数あれば選択ダイアログを表示する。
+        """
         folder_path = filedialog.askdirectory(
             title="DICOMファイルが含まれるフォルダを選択",
             initialdir=os.path.dirname(os.path.abspath(__file__))
@@ -241,97 +339,318 @@ class DICOMViewer:
             if self.volume is None:
                 self.show_welcome_message()
             return
-        dcm_files = []
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                if file.lower().endswith('.dcm'):
-                    dcm_files.append(os.path.join(root, file))
-        if not dcm_files:
-            messagebox.showwarning("警告", "フォルダ内にDICOMファイルが見つかりませんでした")
+        # 表示中のシリーズの読み込みは、新しいシリーズを開くときに中止する
+        self.cancel_active_scan()
+        cancelled = threading.Event()
+        self.active_scan = cancelled
+        state = {'done': 0, 'total': 0, 'series': None, 'error': None}
+        finished = threading.Event()
+
+        def progress(done, total):
+            state['done'], state['total'] = done, total
+
+        def scan():
+            try:
+                with self.profiler.measure("load.index"):
+                    state['series'] = self.series_index.scan(folder_path, progress=progress, cancelled=cancelled)
+            except Exception as e:
+                state['error'] = e
+            finally:
+                finished.set()
+
+        def poll():
+            if self.active_scan is not cancelled:
+                return
+            if not finished.is_set():
+                if state['total']:
+                    self.file_label.config(text=f"ファイル: ヘッダを索引化しています... {state['done']}/{state['total']}",
+                                           foreground="gray")
+                self.root.after(100, poll)
+                return
+            self.active_scan = None
+            if state['error'] is not None:
+                self.file_label.config(text="ファイル: 読み込み失敗", foreground="red")
+                messagebox.showerror("エラー", f"フォルダの走査に失敗しました:\n{str(state['error'])}")
+                return
+            series = state['series']
+            if not series:
+                self.file_label.config(text="ファイル: 未選択", foreground="gray")
+                messagebox.showwarning("警告", "フォルダ内にDICOMファイルが見つかりませんでした")
+                return
+            if len(series) == 1:
+                self.open_series(folder_path, series[0])
+            else:
+                self.file_label.config(text=f"ファイル: {len(series)}個のシリーズ", foreground="gray")
+                self.show_series_picker(folder_path, series)
+
+        self.file_label.config(text="ファイル: フォルダを走査しています...", foreground="gray")
+        threading.Thread(target=scan, daemon=True).start()
+        poll()
+
+    def open_series(self, folder_path, series):
+        """索引のシリーズを読み込む（キャッシュにあればそれを使う）"""
+        dcm_files = series['files']
+        cache_key = self.series_cache.key_for(folder_path, dcm_files)
+        cached = self.series_cache.load(cache_key)
+        if cached is not None:
+            volume, dicom_data = cached
+            self.cancel_active_load()
+            self.finish_loading_files(volume, dicom_data, dcm_files)
             return
-        self.load_dicom_files(dcm_files)
-    def load_dicom_files(self, file_paths):
-        try:
-            progress_window = tk.Toplevel(self.root)
-            progress_window.title("読み込み中...")
-            progress_window.geometry("400x100")
-            progress_window.transient(self.root)
-            progress_window.grab_set()
-            progress_label = ttk.Label(progress_window, text="DICOMファイルを読み込んでいます...")
-            progress_label.pack(pady=10)
-            progress_bar = ttk.Progressbar(progress_window, length=300, mode='determinate')
-            progress_bar.pack(pady=10)
-            dicom_slices = []
-            total_files = len(file_paths)
-            
-            for idx, file_path in enumerate(file_paths):
+        self.load_dicom_files(dcm_files, cache_key=cache_key)
+
+    def show_series_picker(self, folder_path, series):
+        """シリーズの一覧を表示し、選ばれたシリーズを読み込む"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("シリーズの選択")
+        dialog.geometry("720x320")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        ttk.Label(dialog, text=f"{len(series)}個のシリーズが見つかりました。表示するシリーズを選択してください。").pack(
+            anchor=tk.W, padx=10, pady=(10, 5))
+        headings = (("number", "番号", 50), ("modality", "モダリティ", 80), ("description", "説明", 250),
+                    ("images", "枚数", 60), ("matrix", "マトリクス", 90), ("date", "検査日", 90), ("patient", "患者名", 100))
+        tree = ttk.Treeview(dialog, columns=[h[0] for h in headings], show="headings", selectmode="browse", height=10)
+        for column, text, width in headings:
+            tree.heading(column, text=text)
+            tree.column(column, width=width, anchor=tk.W)
+        for i, s in enumerate(series):
+            number = s['series_number'] if s['series_number'] is not None else "-"
+            tree.insert('', tk.END, iid=str(i), values=(number, s['modality'] or "-", s['series_description'] or "-",
+                                                         s['frames'], f"{s['cols']}x{s['rows']}",
+                                                         s['study_date'] or "-", s['patient_name'] or "-"))
+        tree.pack(fill=tk.BOTH, expand=True, padx=10)
+        # 枚数の最も多いシリーズを選んでおく（スカウト像などを避けるため）
+        largest = str(max(range(len(series)), key=lambda i: series[i]['frames']))
+        tree.selection_set(largest)
+        tree.focus(largest)
+
+        def open_selected(event=None):
+            selection = tree.selection()
+            if not selection:
+                return
+            dialog.destroy()
+            self.open_series(folder_path, series[int(selection[0])])
+
+        tree.bind('<Double-1>', open_selected)
+        tree.bind('<Return>', open_selected)
+        buttons = ttk.Frame(dialog)
+        buttons.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Button(buttons, text="キャンセル", command=dialog.destroy).pack(side=tk.RIGHT, padx=3)
+        ttk.Button(buttons, text="開く", command=open_selected).pack(side=tk.RIGHT, padx=3)
+        tree.focus_set()
+
+    def load_dicom_files(self, file_paths, cache_key=None):
+        """ヘッダでスライス順を決め、画素データはバックグラウンドで並列デコードする
+
+        cache_key を指定した場合は、読み込み完了後にシリーズキャッシュへ保存する。
+        streaming_load が有効なら、デコードされたスライスから順に表示する。
+        """
+        # 表示中のシリーズの読み込みは、新しいボリュームを表示するときに中止する
+        self.cancel_active_scan()
+        if self.active_loader is not None and self.active_loader is not self.shown_loader:
+            self.active_loader.cancel()
+        loader = SeriesLoader(file_paths, max_workers=self.load_workers, lazy=self.lazy_decode,
+                              memmap_threshold=self.memmap_threshold, profiler=self.profiler)
+        self.active_loader = loader
+        threading.Thread(target=loader.run, daemon=True).start()
+        if self.streaming_load:
+            self.stream_dicom_files(loader, file_paths, cache_key)
+            return
+        progress_window = tk.Toplevel(self.root)
+        progress_window.title("読み込み中...")
+        progress_window.geometry("400x100")
+        progress_window.transient(self.root)
+        progress_window.grab_set()
+        progress_label = ttk.Label(progress_window, text="DICOMヘッダを読み込んでいます...")
+        progress_label.pack(pady=10)
+        progress_bar = ttk.Progressbar(progress_window, length=300, mode='determinate')
+        progress_bar.pack(pady=10)
+
+        def poll():
+            progress_bar['value'] = loader.progress() * 100
+            if loader.phase == "decode":
+                progress_label.config(text=f"画素データをデコードしています... ({loader.slice_count}スライス)")
+            if not loader.done():
+                self.root.after(50, poll)
+                return
+            self.active_loader = None
+            progress_window.destroy()
+            if loader.error is not None:
+                messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました:\n{str(loader.error)}")
+                return
+            if loader.volume is None:
+                messagebox.showerror("エラー", "有効なDICOMファイルが見つかりませんでした")
+                return
+            self.cancel_active_load()
+            self.finish_loading_files(loader.volume, loader.dicom_data, file_paths)
+            self.store_in_cache(cache_key, loader, file_paths)
+
+        poll()
+
+    def cancel_active_scan(self):
+        """索引化中のフォルダがあれば中止する"""
+        if self.active_scan is not None:
+            self.active_scan.set()
+            self.active_scan = None
+
+    def cancel_active_load(self):
+        """索引化中のフォルダや読み込み中のシリーズがあれば中止する"""
+        self.cancel_active_scan()
+        for loader in (self.active_loader, self.shown_loader):
+            if loader is not None:
+                loader.cancel()
+        self.active_loader = None
+        self.shown_loader = None
+        self.streaming = False
+
+    def replace_shown_loader(self, loader):
+        """新しい読み込みのボリュームを表示する前に、表示中の読み込みを中止する"""
+        if self.shown_loader is not None and self.shown_loader is not loader:
+            self.shown_loader.cancel()
+        self.shown_loader = loader
+
+    def stream_dicom_files(self, loader, file_paths, cache_key):
+        """進捗ダイアログを出さず、中央のスライスから順に表示しながら読み込む"""
+        self.file_label.config(text="ファイル: ヘッダを読み込んでいます...", foreground="gray")
+        state = {'shown': False}
+
+        def poll():
+            # 後から開始した読み込みがまだ表示されていない間は、表示中のボリュームの読み込みを続ける
+            latest = self.active_loader is loader
+            if not latest and self.shown_loader is not loader:
+                return
+            if latest and not state['shown'] and loader.volume is not None:
+                state['shown'] = True
+                self.replace_shown_loader(loader)
+                loader.volume.decode_on_access = False
+                self.streaming = True
                 try:
-                    ds = pydicom.dcmread(file_path)
-                    if hasattr(ds, 'ImagePositionPatient'):
-                        slice_location = ds.ImagePositionPatient[2]
-                    elif hasattr(ds, 'SliceLocation'):
-                        slice_location = ds.SliceLocation
-                    else:
-                        slice_location = idx
-                    dicom_slices.append((slice_location, ds))
-                    progress_bar['value'] = (idx + 1) / total_files * 100
-                    progress_window.update()
+                    self.show_volume(loader.volume, loader.dicom_data)
                 except Exception as e:
-                    print(f"警告: {file_path} の読み込みに失敗しました: {e}")
-                    continue
-            if not dicom_slices:
-                progress_window.destroy()
+                    loader.cancel()
+                    loader.volume.decode_on_access = True
+                    self.shown_loader = None
+                    self.streaming = False
+                    messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました:\n{str(e)}")
+                    return
+            elif state['shown']:
+                self.update_display()
+                self.draw_histogram()
+            if not loader.done():
+                if latest and loader.volume is not None:
+                    self.file_label.config(
+                        text=f"ファイル: 読み込み中... {loader.volume.loaded_count()}/{loader.slice_count}スライス",
+                        foreground="gray")
+                self.root.after(100, poll)
+                return
+            if latest:
+                self.active_loader = None
+            if state['shown']:
+                # 途中で失敗しても、残りのスライスはアクセスされた時点でデコードする
+                self.shown_loader = None
+                self.streaming = False
+                loader.volume.decode_on_access = True
+            if loader.error is not None:
+                if latest:
+                    self.file_label.config(text="ファイル: 読み込み失敗", foreground="red")
+                messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました:\n{str(loader.error)}")
+                return
+            if loader.volume is None:
+                self.file_label.config(text="ファイル: 未選択", foreground="gray")
                 messagebox.showerror("エラー", "有効なDICOMファイルが見つかりませんでした")
                 return
-            dicom_slices.sort(key=lambda x: x[0])
-            
-            slices_data = []
-            for _, ds in dicom_slices:
-                pixel_array = ds.pixel_array
-                if len(pixel_array.shape) == 2:
-                    slices_data.append(pixel_array)
-                elif len(pixel_array.shape) == 3:
-                    for i in range(pixel_array.shape[0]):
-                        slices_data.append(pixel_array[i])
-            
-            self.volume = np.stack(slices_data, axis=0).astype(np.float32)
-            self.dicom_data = dicom_slices[0][1]  
-            progress_window.destroy()
-            self.slice_axial_slider.config(to=self.volume.shape[0] - 1)
-            self.current_slice_axial = self.volume.shape[0] // 2
-            self.slice_axial_var.set(self.current_slice_axial)
-            self.update_slice_range()
-            if hasattr(self.dicom_data, 'WindowWidth') and hasattr(self.dicom_data, 'WindowCenter'):
-                ww = self.dicom_data.WindowWidth
-                wl = self.dicom_data.WindowCenter
-                self.window_width = int(ww[0] if isinstance(ww, (list, tuple)) else ww)
-                self.window_level = int(wl[0] if isinstance(wl, (list, tuple)) else wl)
+            if not state['shown']:
+                self.replace_shown_loader(None)
+                self.streaming = False
+                self.show_volume(loader.volume, loader.dicom_data)
             else:
-                self.window_width = int(np.ptp(self.volume))
-                self.window_level = int(np.mean(self.volume))
-            self.ww_var.set(self.window_width)
-            self.wl_var.set(self.window_level)
-            
-            # 画像情報を更新
-            self.update_image_info()
-            
-            self.update_display()
-            if len(file_paths) == 1:
-                filename = os.path.basename(file_paths[0])
-            else:
-                filename = f"{len(file_paths)}個のファイル ({len(slices_data)}スライス)"
-            self.file_label.config(text=f"ファイル: {filename}", foreground="green")
+                if self.estimated_window == (self.window_width, self.window_level):
+                    # 途中の統計で決めたウィンドウは、操作されていなければ全スライスで決め直す
+                    self.apply_auto_window(*self.auto_window_range)
+                self.update_display()
+                self.draw_histogram()
+                self.start_background_builds()
+            self.estimated_window = None
+            if latest:
+                self.file_label.config(text=f"ファイル: {self.loaded_files_text(file_paths)}", foreground="green")
+            self.store_in_cache(cache_key, loader, file_paths)
+
+        poll()
+
+    def store_in_cache(self, cache_key, loader, file_paths):
+        if cache_key is not None:
+            threading.Thread(target=self.series_cache.store, daemon=True,
+                             args=(cache_key, loader.volume, loader.dicom_data, len(file_paths))).start()
+
+    def loaded_files_text(self, file_paths):
+        if len(file_paths) == 1:
+            return os.path.basename(file_paths[0])
+        return f"{len(file_paths)}個のファイル ({self.volume.shape[0]}スライス)"
+
+    def show_volume(self, volume, dicom_data):
+        """ボリュームを表示に反映する（スライダー範囲・ウィンドウ・画像情報）"""
+        self.dicom_data = dicom_data
+        self.set_volume(volume)
+        self.slice_axial_slider.config(to=self.volume.shape[0] - 1)
+        self.current_slice_axial = self.volume.shape[0] // 2
+        self.slice_axial_var.set(self.current_slice_axial)
+        self.update_slice_range()
+        window = header_window(self.dicom_data)
+        if window is None:
+            # デコード済みスライスの統計から決める（読み込み中は中央のスライスだけでも推定できる）
+            self.volume.load_range(self.current_slice_axial, self.current_slice_axial + 1)
+            window = self.volume.stats.auto_window(*self.auto_window_range)
+            self.estimated_window = window if self.streaming else None
+        self.window_width, self.window_level = window
+        self.ww_var.set(self.window_width)
+        self.wl_var.set(self.window_level)
+        
+        # 画像情報を更新
+        self.update_image_info()
+        
+        self.draw_histogram(force=True)
+        self.update_display()
+
+    def finish_loading_files(self, volume, dicom_data, file_paths):
+        """デコード済みのボリュームを表示に反映する"""
+        try:
+            self.show_volume(volume, dicom_data)
+            self.file_label.config(text=f"ファイル: {self.loaded_files_text(file_paths)}", foreground="green")
             
             messagebox.showinfo("成功", 
                             f"DICOMファイルを読み込みました\n"
                             f"ファイル数: {len(file_paths)}\n"
-                            f"スライス数: {len(slices_data)}\n"
+                            f"スライス数: {self.volume.shape[0]}\n"
                             f"形状: {self.volume.shape}")
         except Exception as e:
-            if 'progress_window' in locals():
-                progress_window.destroy()
             messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました:\n{str(e)}")
     
+    def set_volume(self, volume):
+        """表示するボリュームを差し替え、古いボリュームの一時ファイルを解放する"""
+        self.stop_cine()
+        if self.volume is not None and self.volume is not volume:
+            self.volume.close()
+        self.volume = volume
+        if volume.geometry is None:
+            volume.geometry = VolumeGeometry.from_dataset(self.dicom_data, volume.shape)
+        self.reslicer = Reslicer(volume, volume.geometry)
+        self.slab_projectors = {}
+        self.volume_generation += 1
+        self.prefetcher.cancel()
+        self.slice_cache.clear()
+        self.artists = None
+        self.panel_keys = {}
+        if not self.streaming:
+            self.start_background_builds()
+
+    def start_background_builds(self):
+        """連続コピーとピラミッドをバックグラウンドで作る（全スライスのデコード後に呼ぶ）"""
+        self.start_plane_copies()
+        if self.volume is not None:
+            threading.Thread(target=self.volume.build_pyramid, daemon=True,
+                             kwargs={'min_matrix': self.pyramid_min_matrix}).start()
+
     def update_slice_range(self):
         """スライス範囲を更新"""
         if self.volume is None:
@@ -340,6 +659,11 @@ class DICOMViewer:
         if self.view_mode == "Sagittal":
             max_slice = self.volume.shape[2] - 1
             self.current_slice_other = min(self.current_slice_other, max_slice)
+        elif self.view_mode == "Oblique":
+            # 斜断面はボリューム中心を通る位置から法線方向へ送る（中央が中心）
+            _, half = self.reslicer.oblique_steps()
+            max_slice = 2 * half
+            self.current_slice_other = half
         else:  
             max_slice = self.volume.shape[1] - 1
             self.current_slice_other = min(self.current_slice_other, max_slice)
@@ -451,23 +775,593 @@ class DICOMViewer:
         else:
             self.manufacturer_label.config(text="不明")
     
+    def start_plane_copies(self):
+        """有効なら Sagittal/Coronal 用の連続コピーをバックグラウンドで作る"""
+        if self.volume is None or not self.plane_copies_var.get():
+            return
+        volume = self.volume
+        threading.Thread(target=volume.build_plane_copies, daemon=True,
+                         kwargs={'max_bytes': self.plane_copy_max_bytes}).start()
+
+    def toggle_plane_copies(self):
+        if self.plane_copies_var.get():
+            self.start_plane_copies()
+        elif self.volume is not None:
+            self.volume.drop_plane_copies()
+
+    def show_render_stats(self):
+        """再描画スケジューラの統計と段階ごとの所要時間を表示する"""
+        stats = self.redraw_scheduler.stats()
+        cine = self.cine.stats()
+        lines = [f"描画要求: {stats['requests']}",
+                 f"描画回数: {stats['frames']}",
+                 f"間引いた要求: {stats['dropped']}",
+                 f"描画時間: 平均 {stats['mean_ms']:.1f} ms / 最大 {stats['max_ms']:.1f} ms",
+                 f"シネ再生: {cine['shown']}フレーム表示 / {cine['skipped']}フレーム飛ばし / "
+                 f"実効 {cine['achieved_fps']:.1f} fps（目標 {cine['target_fps']} fps）",
+                 ""]
+        for stage, s in self.profiler.stats().items():
+            lines.append(f"{stage}: p50 {s['p50_ms']:.1f} / p95 {s['p95_ms']:.1f} / "
+                         f"p99 {s['p99_ms']:.1f} ms ({s['count']}回)")
+        messagebox.showinfo("描画統計", "\n".join(lines))
+
+    def overlay_text(self):
+        """オーバーレイに出すFPSと段階ごとの遅延"""
+        stages = self.profiler.stats(("display.frame",) + self.overlay_stages)
+        frame = stages.get("display.frame")
+        lines = [f"FPS {self.profiler.rate('display.frame'):5.1f}"]
+        if frame is not None:
+            lines[0] += f"  frame p50 {frame['p50_ms']:.1f} p95 {frame['p95_ms']:.1f} p99 {frame['p99_ms']:.1f} ms"
+        for stage in self.overlay_stages:
+            if stage in stages:
+                s = stages[stage]
+                lines.append(f"{stage.split('.')[1]:<8} p50 {s['p50_ms']:.1f} p95 {s['p95_ms']:.1f} "
+                             f"p99 {s['p99_ms']:.1f} ms")
+        return "\n".join(lines)
+
+    def toggle_overlay(self):
+        if self.artists is None:
+            return
+        self.overlay.set_visible(self.overlay_var.get())
+        self.overlay.set_text(self.overlay_text())
+        self.blit_panels(['axial'])
+
+    def save_profile(self):
+        """計測値とトレースを JSON または CSV で保存する"""
+        path = filedialog.asksaveasfilename(title="プロファイルを保存", defaultextension=".json",
+                                            filetypes=[("JSON", "*.json"), ("CSV（トレースのみ）", "*.csv")])
+        if not path:
+            return
+        try:
+            self.profiler.dump(path)
+        except OSError as e:
+            messagebox.showerror("エラー", f"プロファイルを保存できませんでした:\n{str(e)}")
+
+    def reset_profile(self):
+        self.profiler.reset()
+        self.redraw_scheduler.reset_stats()
+
+    def apply_auto_window(self, low, high):
+        """デコード済みスライスのパーセンタイル low〜high をウィンドウにする"""
+        if self.volume is None or not self.volume.stats.covered:
+            return
+        ww, wl = self.volume.stats.auto_window(low, high)
+        self.ww_var.set(ww)
+        self.wl_var.set(wl)
+        self.update_display()
+
+    def draw_histogram(self, force=False):
+        """統計のヒストグラム（度数は対数）と現在のウィンドウ範囲を描く
+
+        統計に含まれるスライス数かキャンバスの大きさが変わったときだけ描き直す。
+        """
+        canvas = self.histogram_canvas
+        stats = self.volume.stats if self.volume is not None else None
+        if stats is None or not stats.covered:
+            canvas.delete('all')
+            self.histogram_state = None
+            return
+        width, height = int(canvas.winfo_width()), int(canvas.winfo_height())
+        if width < 10 or height < 10:
+            return
+        state = (id(stats), stats.covered, width, height)
+        if not force and state == self.histogram_state:
+            return
+        lower, upper = (float(v) for v in stats.percentile([0.1, 99.9]))
+        if upper <= lower:
+            lower, upper = stats.min(), stats.max() + 1
+        counts, edges = stats.histogram(bins=max(width // 2, 1), value_range=(lower, upper))
+        heights = np.log1p(counts)
+        scale = (height - 2) / heights.max() if heights.max() > 0 else 0
+        step = width / len(counts)
+        points = [0, height]
+        for i, h in enumerate(heights):
+            y = height - h * scale
+            points.extend((i * step, y, (i + 1) * step, y))
+        points.extend((width, height))
+        canvas.delete('all')
+        canvas.create_polygon(points, fill='#8a8a8a', outline='')
+        canvas.create_rectangle(0, 0, 0, 0, outline='#ffd700', tags='window')
+        canvas.create_line(0, 0, 0, 0, fill='#00ffff', tags='level')
+        self.histogram_state = state
+        self.histogram_range = (lower, upper)
+        # スライダーの範囲を値の範囲に合わせて広げる
+        low, high = stats.min(), stats.max()
+        self.ww_slider.config(to=max(2000, int(high - low) + 1))
+        self.wl_slider.config(from_=min(-1000, int(low)), to=max(1000, int(high)))
+        self.update_histogram_window()
+
+    def update_histogram_window(self):
+        """ヒストグラム上のウィンドウ範囲（枠）とレベル（線）を移動する"""
+        if self.histogram_state is None:
+            return
+        lower, upper = self.histogram_range
+        width, height = self.histogram_state[2:]
+
+        def x(value):
+            return min(max((value - lower) / (upper - lower) * width, -1), width + 1)
+
+        ww, wl = self.window_width, self.window_level
+        self.histogram_canvas.coords('window', x(wl - ww / 2), 1, x(wl + ww / 2), height - 1)
+        self.histogram_canvas.coords('level', x(wl), 0, x(wl), height)
+
     def change_view_mode(self, event=None):
+        if self.view_mode_var.get() == "Oblique" and self.volume is not None and self.volume.shape[0] < 2:
+            messagebox.showwarning("警告", "斜断面の表示には2枚以上のスライスが必要です")
+            self.view_mode_var.set(self.view_mode)
+            return
         self.view_mode = self.view_mode_var.get()
         self.update_slice_range()
         self.update_display()
     
-    def apply_window(self, image, ww, wl):
-        min_value = wl - ww / 2
-        max_value = wl + ww / 2
-        
-        windowed = np.clip(image, min_value, max_value)
-        windowed = (windowed - min_value) / (max_value - min_value) * 255
-        
-        return windowed.astype(np.uint8)
+    def change_slab_mode(self, event=None):
+        self.slab_mode = self.slab_mode_var.get()
+        self.slab_projectors = {}
+        self.update_display()
+
+    def slab_range(self, plane, index):
+        """スラブ投影するスライスの範囲 (開始, 終了)（投影しない場合は None）
+
+        厚み(mm)をその断面方向の間隔で割った枚数を index を中心に取り、
+        ボリュームの端では内側にずらす。
+        """
+        if self.slab_mode not in SLAB_MODES or plane == "Oblique":
+            return None
+        geometry = self.volume.geometry
+        spacing = {"Axial": geometry.slice_spacing, "Sagittal": geometry.dx, "Coronal": geometry.dy}[plane]
+        size = plane_size(self.volume.shape, plane)
+        count = min(max(int(round(self.slab_thickness / spacing)), 1), size)
+        if count <= 1:
+            return None
+        start = min(max(index - count // 2, 0), size - count)
+        return start, start + count
+
+    def slab_image(self, plane, start, stop):
+        """スラブ投影した画像（スラブの移動分だけ差分更新する）"""
+        complete = self.volume.loaded_count() == self.volume.shape[0]
+        key = (plane, self.slab_mode, complete)
+        projector = self.slab_projectors.get(key)
+        if projector is None:
+            self.slab_projectors = {k: p for k, p in self.slab_projectors.items() if k[0] != plane}
+            projector = self.slab_projectors[key] = plane_projector(self.volume, plane, self.slab_mode)
+        if not complete:
+            # 読み込み中は元データが変わるので毎回作り直す
+            projector.reset()
+        return projector.project(start, stop)
+
+    def slab_text(self, plane, index):
+        """スラブ投影中を示すタイトルの後置文字列"""
+        if self.slab_range(plane, index) is None:
+            return ""
+        return f" {self.slab_mode} {self.slab_thickness}mm"
+
+    def apply_window(self, image, ww, wl, buffer=None):
+        # 格納値のまま、リスケール（CT値への変換）はLUTに含めて適用する
+        if self.volume is None:
+            return self.windowing.apply(image, ww, wl, buffer=buffer)
+        return self.windowing.apply(image, ww, wl, buffer=buffer, rescale=self.volume.rescale,
+                                    value_range=self.volume.stats.stored_range())
     
+    def setup_artists(self):
+        """画像・交差線・タイトルのアーティストを一度だけ作成する
+
+        以降の更新は set_data / set_xdata などで行い、背景をコピーして
+        変化したパネルだけをブリットする。
+        """
+        self.ax1.clear()
+        self.ax2.clear()
+        placeholder = np.zeros((2, 2), dtype=np.uint8)
+        axial_image = self.ax1.imshow(placeholder, cmap='gray', aspect='auto', vmin=0, vmax=255, animated=True)
+        vline = self.ax1.axvline(x=0, color='cyan', linewidth=2, linestyle='--', alpha=0.8, animated=True)
+        hline = self.ax1.axhline(y=0, color='yellow', linewidth=2, linestyle='--', alpha=0.8, animated=True)
+        oblique_line, = self.ax1.plot([0, 0], [0, 0], color='magenta', linewidth=2, linestyle='--', alpha=0.8,
+                                      animated=True, visible=False)
+        other_image = self.ax2.imshow(placeholder, cmap='gray', aspect='auto', vmin=0, vmax=255, animated=True)
+        overlay = self.ax1.text(0.01, 0.99, '', transform=self.ax1.transAxes, ha='left', va='top',
+                                color='#7CFC00', fontsize=8, family='monospace', animated=True,
+                                visible=self.overlay_var.get(),
+                                bbox=dict(facecolor='black', alpha=0.6, edgecolor='none'))
+        for ax in (self.ax1, self.ax2):
+            ax.set_title(' ', color='white', fontsize=12, fontweight='bold')
+            ax.title.set_animated(True)
+            ax.axis('off')
+            ax.set_facecolor('#1a1a1a')
+        self.artists = {
+            'axial': [axial_image, vline, hline, oblique_line, self.ax1.title, overlay],
+            'other': [other_image, self.ax2.title],
+        }
+        self.axial_image = axial_image
+        self.other_image = other_image
+        self.crosshair_vline = vline
+        self.crosshair_hline = hline
+        self.oblique_line = oblique_line
+        self.overlay = overlay
+        self.backgrounds = None
+        self.panel_keys = {}
+        self.fig.tight_layout()
+        self.canvas.draw()
+
+    def panel_bbox(self, ax):
+        """パネル（画像とその上のタイトル）の再描画範囲"""
+        return Bbox.from_extents(ax.bbox.x0, ax.bbox.y0, ax.bbox.x1, self.fig.bbox.y1)
+
+    def on_canvas_draw(self, event=None):
+        """全体描画の後に背景を保存し直し、アニメーション用のアーティストを描く"""
+        if self.artists is None:
+            return
+        self.backgrounds = {
+            'axial': self.canvas.copy_from_bbox(self.panel_bbox(self.ax1)),
+            'other': self.canvas.copy_from_bbox(self.panel_bbox(self.ax2)),
+        }
+        for name, ax in (('axial', self.ax1), ('other', self.ax2)):
+            for artist in self.artists[name]:
+                ax.draw_artist(artist)
+
+    def blit_panels(self, names):
+        """指定したパネルだけを背景から描き直す"""
+        if self.backgrounds is None:
+            self.canvas.draw()
+            return
+        for name in names:
+            ax = self.ax1 if name == 'axial' else self.ax2
+            self.canvas.restore_region(self.backgrounds[name])
+            for artist in self.artists[name]:
+                ax.draw_artist(artist)
+            self.canvas.blit(self.panel_bbox(ax))
+
+    def set_image_data(self, image, data, shape):
+        """画像を差し替える（縮小レベルでも座標は元解像度の shape に合わせる）"""
+        extent = (-0.5, shape[1] - 0.5, shape[0] - 0.5, -0.5)
+        if tuple(image.get_extent()) != extent:
+            image.set_extent(extent)
+            image.axes.set_xlim(extent[0], extent[1])
+            image.axes.set_ylim(extent[2], extent[3])
+            # 縦横比を保つと軸の大きさが変わるので背景から描き直す
+            self.backgrounds = None
+        image.set_data(data)
+
+    def set_panel_aspect(self, ax, aspect):
+        """画素間隔に合わせた縦横比にする（変わった場合は全体を描き直す）"""
+        if ax.get_aspect() != aspect:
+            ax.set_aspect(aspect, adjustable='box')
+            self.backgrounds = None
+
+    def plane_shape(self, plane):
+        """元解像度での表示画像の (行, 列)"""
+        if plane == "Oblique":
+            size = self.reslicer.oblique_size()
+            return size, size
+        return self.volume.geometry.plane_shape(plane)
+
+    def display_level(self, plane, ax):
+        """操作中はパネルのピクセル数に見合うピラミッドレベルを選ぶ
+
+        斜断面はピラミッドを使わず、標本点の数をレベルごとに縦横1/2にする。
+        間隔が不均一なボリュームの Sagittal/Coronal は常に元解像度で再標本化する。
+        """
+        if not self.interacting or self.slab_range(plane, 0) is not None:
+            return 0
+        if plane == "Oblique":
+            return choose_level(self.plane_shape(plane), (ax.bbox.height, ax.bbox.width), 2)
+        if plane != "Axial" and not self.volume.geometry.regular:
+            return 0
+        reducible = (True, True) if plane == "Axial" else (False, True)
+        return choose_level(self.plane_shape(plane), (ax.bbox.height, ax.bbox.width),
+                            len(self.volume.pyramid), reducible)
+
+    def oblique_offset(self, index=None):
+        """斜断面のボリューム中心からの位置(mm)"""
+        step, half = self.reslicer.oblique_steps()
+        return ((self.current_slice_other if index is None else index) - half) * step
+
+    def on_image_press(self, event):
+        """斜断面の表示中は Axial 画像のドラッグで断面の角度を変える"""
+        if self.volume is None or self.view_mode != "Oblique" or event.inaxes is not self.ax1 or event.button != 1:
+            return
+        self.dragging_oblique = True
+        self.on_image_drag(event)
+
+    def on_image_drag(self, event):
+        if not self.dragging_oblique or event.inaxes is not self.ax1 or event.xdata is None:
+            return
+        geometry = self.volume.geometry
+        dx = (event.xdata - (self.volume.shape[2] - 1) / 2) * geometry.dx
+        dy = (event.ydata - (self.volume.shape[1] - 1) / 2) * geometry.dy
+        if dx == 0 and dy == 0:
+            return
+        # 画像中心からマウス位置へ向かう線が交線になる角度（-90〜90度）
+        angle = (math.degrees(math.atan2(-dx, dy)) + 90) % 180 - 90
+        self.oblique_angle_var.set(int(round(angle)))
+        self.request_redraw()
+
+    def on_image_release(self, event):
+        self.dragging_oblique = False
+
+    def request_redraw(self, *args):
+        """操作による再描画を要求し、操作が止まったら元解像度で描き直す"""
+        self.interacting = True
+        if self.refine_timer is not None:
+            self.root.after_cancel(self.refine_timer)
+        self.refine_timer = self.root.after(self.refine_delay_ms, self.refine_display)
+        self.redraw_scheduler.request()
+
+    def refine_display(self):
+        self.refine_timer = None
+        self.interacting = False
+        self.update_display()
+
+    def windowed_slice(self, plane, index, buffer, scrubbing, level=0):
+        """キャッシュを使ってウィンドウ処理済みのスライスを返す
+
+        WW/WLを操作中はキャッシュに入れず、再利用バッファに書き込む。
+        """
+        slab = self.slab_range(plane, index)
+        if slab is not None:
+            plane_key = (plane, self.slab_mode) + slab
+        elif plane == "Oblique":
+            plane_key = (plane, self.oblique_angle, self.oblique_tilt)
+        else:
+            plane_key = plane
+        key = (self.volume_generation, plane_key, index, level, self.window_width, self.window_level)
+        image = self.slice_cache.get(key)
+        if image is not None:
+            return image
+        if self.streaming and plane == "Axial":
+            # 読み込み中でも表示中のAxialスライスは優先してデコードする
+            self.volume.load_range(*(slab or (index, index + 1)))
+        with self.profiler.measure("display.extract"):
+            source = self.plane_source(plane, index, level)
+        if slab is not None:
+            complete = self.volume.loaded_count() == self.volume.shape[0]
+        else:
+            complete = self.slice_complete(plane, index)
+        with self.profiler.measure("display.window"):
+            if scrubbing or not complete:
+                return self.apply_window(source, self.window_width, self.window_level, buffer=buffer)
+            image = self.apply_window(source, self.window_width, self.window_level)
+        self.slice_cache.put(key, image)
+        return image
+
+    def plane_source(self, plane, index, level=0):
+        """表示する断面の元画像（スラブ投影・斜断面を含む）"""
+        slab = self.slab_range(plane, index)
+        if slab is not None:
+            return self.slab_image(plane, *slab)
+        if plane == "Oblique":
+            return self.reslicer.oblique(self.oblique_angle, self.oblique_tilt, self.oblique_offset(index),
+                                         level, buffer='oblique')
+        return plane_slice(self.volume, plane, index, level)
+
+    def slice_complete(self, plane, index):
+        """スライスの元データがすべてデコード済みか"""
+        if plane == "Axial":
+            return self.volume.is_loaded(index)
+        return self.volume.loaded_count() == self.volume.shape[0]
+
+    def pending_text(self, plane, index):
+        """未デコードのスライスを示すタイトルの後置文字列"""
+        if self.slice_complete(plane, index):
+            return ""
+        if plane == "Axial":
+            return " (読み込み中)"
+        return f" (読み込み中 {self.volume.loaded_count()}/{self.volume.shape[0]})"
+
+    def step_slice(self, panel, delta):
+        """スライスを delta 枚送る"""
+        if self.volume is None:
+            return
+        var, slider = ((self.slice_axial_var, self.slice_axial_slider) if panel == 'axial'
+                       else (self.slice_other_var, self.slice_other_slider))
+        value = min(max(int(var.get()) + delta, 0), int(slider.cget('to')))
+        var.set(value)
+        self.request_redraw()
+
+    def on_arrow_key(self, event, panel, delta):
+        if event.widget.winfo_class() in ('TScale', 'TCombobox', 'TEntry'):
+            return
+        self.step_slice(panel, delta)
+
+    def on_image_scroll(self, event):
+        if event.inaxes is self.ax1:
+            self.step_slice('axial', int(event.step))
+        elif event.inaxes is self.ax2:
+            self.step_slice('other', int(event.step))
+
+    def prefetch_neighbors(self, previous, levels):
+        """スクロール方向の先のスライスを先読みする"""
+        targets = []
+        for plane, index in (("Axial", self.current_slice_axial), (self.view_mode, self.current_slice_other)):
+            if plane == "Oblique" or self.slab_range(plane, index) is not None:
+                continue
+            if plane != "Axial" and self.volume.shape[0] == 1:
+                continue
+            last = previous.get(plane)
+            if last is not None and last != index:
+                self.scroll_directions[plane] = 1 if index > last else -1
+            targets.append((plane, index, self.scroll_directions[plane], levels[plane]))
+        self.prefetcher.schedule(self.volume, self.volume_generation, targets,
+                                 self.window_width, self.window_level)
+
+    def render_axial(self, scrubbing=False, level=0, image=None):
+        axial_windowed = image if image is not None else self.windowed_slice("Axial", self.current_slice_axial, 'axial', scrubbing, level)
+        with self.profiler.measure("display.artists"):
+            self.set_image_data(self.axial_image, axial_windowed, self.plane_shape("Axial"))
+            pending = self.pending_text("Axial", self.current_slice_axial)
+            slab = self.slab_text("Axial", self.current_slice_axial)
+            self.ax1.set_title(f'Axial (Slice {self.current_slice_axial}){slab}{pending}', color='white', fontsize=12, fontweight='bold')
+            if self.view_mode == "Sagittal":
+                self.crosshair_vline.set_xdata([self.current_slice_other, self.current_slice_other])
+            elif self.view_mode == "Coronal":
+                self.crosshair_hline.set_ydata([self.current_slice_other, self.current_slice_other])
+            else:
+                self.update_oblique_line()
+            volume_view = self.volume.shape[0] > 1
+            self.crosshair_vline.set_visible(volume_view and self.view_mode == "Sagittal")
+            self.crosshair_hline.set_visible(volume_view and self.view_mode == "Coronal")
+            if self.view_mode != "Oblique":
+                self.oblique_line.set_visible(False)
+
+    def update_oblique_line(self):
+        """Axial 画像上に斜断面との交線を描く（交わらなければ隠す）"""
+        line = self.reslicer.axial_intersection(self.oblique_angle, self.oblique_tilt, self.oblique_offset(),
+                                                self.current_slice_axial)
+        if line is None:
+            self.oblique_line.set_visible(False)
+            return
+        a, b, c = line
+        height, width = self.volume.shape[1:]
+        if abs(b) >= abs(a):
+            xs = np.array([-0.5, width - 0.5])
+            ys = -(a * xs + c) / b
+        else:
+            ys = np.array([-0.5, height - 0.5])
+            xs = -(b * ys + c) / a
+        self.oblique_line.set_data(xs, ys)
+        self.oblique_line.set_visible(True)
+
+    def render_other(self, scrubbing=False, level=0, image=None):
+        if self.volume.shape[0] == 1:
+            # 単一画像は2Dとして表示し、断面は出さない
+            self.other_image.set_visible(False)
+            self.ax2.set_title('単一画像（断面はありません）', color='white', fontsize=12, fontweight='bold')
+            return
+        self.other_image.set_visible(True)
+        other_windowed = image if image is not None else self.windowed_slice(self.view_mode, self.current_slice_other, 'other', scrubbing, level)
+        with self.profiler.measure("display.artists"):
+            self.set_image_data(self.other_image, other_windowed, self.plane_shape(self.view_mode))
+            pending = self.pending_text(self.view_mode, self.current_slice_other)
+            if self.view_mode == "Oblique":
+                title = f'Oblique ({self.oblique_angle}°, 傾き {self.oblique_tilt}°, {self.oblique_offset():+.1f} mm)'
+            else:
+                title = f'{self.view_mode} (Slice {self.current_slice_other})'
+            slab = self.slab_text(self.view_mode, self.current_slice_other)
+            self.ax2.set_title(f'{title}{slab}{pending}', color='white', fontsize=12, fontweight='bold')
+
+    def toggle_cine(self, panel):
+        """panel（'axial' / 'other'）のスライスを目標FPSで繰り返し送る（再生中なら止める）"""
+        if self.volume is None:
+            return
+        if self.cine.playing and self.cine_panel == panel:
+            self.stop_cine()
+            return
+        if self.streaming:
+            messagebox.showinfo("情報", "読み込みが終わってから再生してください")
+            return
+        self.cine.stop()
+        self.redraw_scheduler.flush()
+        self.update_display()
+        self.cine_panel = panel
+        var, slider = self.cine_controls()
+        self.cine_ring.reset(self.cine_key())
+        # 再生前にリングバッファを埋めておく（長くても0.3秒まで）
+        self.cine_fill_cost = 0.0
+        self.fill_cine_ring(time.perf_counter() + 0.3, int(var.get()))
+        self.cine.start(int(slider.cget('to')) + 1, int(var.get()), int(self.cine_fps_var.get()))
+
+    def stop_cine(self):
+        if self.cine_panel is None:
+            return
+        self.cine.stop()
+        self.cine_panel = None
+        self.cine_status_label.config(text="停止中")
+        self.panel_keys = {}
+        self.update_display()
+
+    def change_cine_fps(self, *args):
+        fps = int(self.cine_fps_var.get())
+        self.cine_fps_label.config(text=str(fps))
+        self.cine.set_fps(fps)
+
+    def cine_controls(self):
+        if self.cine_panel == 'axial':
+            return self.slice_axial_var, self.slice_axial_slider
+        return self.slice_other_var, self.slice_other_slider
+
+    def cine_plane(self):
+        return "Axial" if self.cine_panel == 'axial' else self.view_mode
+
+    def cine_key(self):
+        """リングバッファのフレームが有効な表示条件"""
+        return (self.volume_generation, self.cine_plane(), self.window_width, self.window_level,
+                self.slab_mode, self.slab_thickness, self.oblique_angle, self.oblique_tilt)
+
+    def cine_frame(self, position):
+        return self.apply_window(self.plane_source(self.cine_plane(), position), self.window_width, self.window_level)
+
+    def fill_cine_ring(self, deadline, position=None):
+        """次の表示期限までの空き時間に、再生位置の先のフレームをリングバッファに用意する"""
+        if self.cine_panel is None:
+            return
+        if self.cine_ring.key != self.cine_key():
+            self.cine_ring.reset(self.cine_key())
+        count = self.cine.count if position is None else int(self.cine_controls()[1].cget('to')) + 1
+        position = self.cine.position if position is None else position
+        for step in range(1, min(self.cine_ring.capacity, count)):
+            target = (position + step) % count
+            if self.cine_ring.get(target) is not None:
+                continue
+            if time.perf_counter() + self.cine_fill_cost > deadline:
+                return
+            start = time.perf_counter()
+            self.cine_ring.put(target, self.cine_frame(target))
+            cost = time.perf_counter() - start
+            self.cine_fill_cost = cost if not self.cine_fill_cost else 0.8 * self.cine_fill_cost + 0.2 * cost
+
+    def show_cine_frame(self, position):
+        """シネ再生の1フレームを表示し、変わったパネルだけをブリットする"""
+        start = time.perf_counter()
+        if self.cine_ring.key != self.cine_key():
+            self.cine_ring.reset(self.cine_key())
+        image = self.cine_ring.get(position)
+        if image is None:
+            image = self.cine_ring.put(position, self.cine_frame(position))
+        var, _ = self.cine_controls()
+        var.set(position)
+        if self.cine_panel == 'axial':
+            self.current_slice_axial = position
+            self.slice_axial_label.config(text=f"{position}/{self.volume.shape[0]-1}")
+            self.render_axial(image=image)
+            panels = ['axial']
+        else:
+            self.current_slice_other = position
+            self.slice_other_label.config(text=f"{position}/{int(self.slice_other_slider.cget('to'))}")
+            self.render_other(image=image)
+            # Axial画像の交差線も動かす
+            self.render_axial()
+            panels = ['axial', 'other']
+        # 停止後や操作時には通常の描画で描き直す
+        self.panel_keys = {}
+        with self.profiler.measure("display.draw"):
+            self.blit_panels(panels)
+        self.profiler.record("display.frame", time.perf_counter() - start, start)
+        stats = self.cine.stats()
+        self.cine_status_label.config(text=f"再生中 {stats['achieved_fps']:.1f} / {stats['target_fps']} fps"
+                                           f"（飛ばしたフレーム {stats['skipped']}）")
+
     def update_display(self, event=None):
         if self.volume is None:
             return
+        start = time.perf_counter()
         self.current_slice_axial = int(self.slice_axial_var.get())
         self.current_slice_other = int(self.slice_other_var.get())
         self.window_width = int(self.ww_var.get())
@@ -476,31 +1370,49 @@ class DICOMViewer:
         self.slice_other_label.config(text=f"{self.current_slice_other}/{int(self.slice_other_slider.cget('to'))}")
         self.ww_label.config(text=str(self.window_width))
         self.wl_label.config(text=str(self.window_level))
-        axial_img = self.volume[self.current_slice_axial, :, :]
-        axial_windowed = self.apply_window(axial_img, self.window_width, self.window_level)
-        if self.view_mode == "Sagittal":
-            other_img = self.volume[:, :, self.current_slice_other]
-            other_windowed = self.apply_window(other_img, self.window_width, self.window_level)
-        else:
-            other_img = self.volume[:, self.current_slice_other, :]
-            other_windowed = self.apply_window(other_img, self.window_width, self.window_level)
-            other_windowed = np.flipud(np.fliplr(other_windowed))
-        self.ax1.clear()
-        self.ax2.clear()
-        self.ax1.imshow(axial_windowed, cmap='gray', aspect='auto')
-        self.ax1.set_title(f'Axial (Slice {self.current_slice_axial})', color='white', fontsize=12, fontweight='bold')
-        self.ax1.axis('off')
-        if self.view_mode == "Sagittal":
-            self.ax1.axvline(x=self.current_slice_other, color='cyan', linewidth=2, linestyle='--', alpha=0.8)
-        else:
-            self.ax1.axhline(y=self.current_slice_other, color='yellow', linewidth=2, linestyle='--', alpha=0.8)
-        self.ax2.imshow(other_windowed, cmap='gray', aspect='auto')
-        self.ax2.set_title(f'{self.view_mode} (Slice {self.current_slice_other})', color='white', fontsize=12, fontweight='bold')
-        self.ax2.axis('off')
-        self.ax1.set_facecolor('#1a1a1a')
-        self.ax2.set_facecolor('#1a1a1a')
-        self.fig.tight_layout()
-        self.canvas.draw()
+        self.oblique_angle = int(self.oblique_angle_var.get())
+        self.oblique_tilt = int(self.oblique_tilt_var.get())
+        self.oblique_angle_label.config(text=f"{self.oblique_angle}°")
+        self.oblique_tilt_label.config(text=f"{self.oblique_tilt}°")
+        self.slab_thickness = int(self.slab_thickness_var.get())
+        self.slab_thickness_label.config(text=f"{self.slab_thickness} mm")
+        if self.artists is None:
+            self.setup_artists()
+        self.set_panel_aspect(self.ax1, self.volume.geometry.aspect("Axial"))
+        self.set_panel_aspect(self.ax2, self.volume.geometry.aspect(self.view_mode))
+        window = (self.window_width, self.window_level)
+        levels = {"Axial": self.display_level("Axial", self.ax1),
+                  self.view_mode: self.display_level(self.view_mode, self.ax2)}
+        loaded = self.volume.loaded_count()
+        oblique = (self.oblique_angle, self.oblique_tilt) if self.view_mode == "Oblique" else None
+        slab = (self.slab_mode, self.slab_thickness)
+        keys = {
+            'axial': (self.current_slice_axial, self.view_mode, self.current_slice_other, levels["Axial"],
+                      self.volume.is_loaded(self.current_slice_axial), oblique, slab) + window,
+            'other': (self.view_mode, self.current_slice_other, levels[self.view_mode], loaded, oblique, slab) + window,
+        }
+        changed = [name for name in ('axial', 'other') if keys[name] != self.panel_keys.get(name)]
+        previous = self.panel_keys.get('slices', {})
+        scrubbing = 'window' in self.panel_keys and self.panel_keys['window'] != window
+        if self.panel_keys.get('window') != window:
+            self.update_histogram_window()
+        if 'axial' in changed:
+            self.render_axial(scrubbing, levels["Axial"])
+        if 'other' in changed:
+            self.render_other(scrubbing, levels[self.view_mode])
+        keys['window'] = window
+        keys['slices'] = {"Axial": self.current_slice_axial, self.view_mode: self.current_slice_other}
+        self.panel_keys = keys
+        if changed:
+            if self.overlay.get_visible():
+                self.overlay.set_text(self.overlay_text())
+                if 'axial' not in changed:
+                    changed.append('axial')
+            with self.profiler.measure("display.draw"):
+                self.blit_panels(changed)
+            if not self.streaming:
+                self.prefetch_neighbors(previous, levels)
+            self.profiler.record("display.frame", time.perf_counter() - start, start)
 
 def main():
     root = tk.Tk()
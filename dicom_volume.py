@@ -0,0 +1,220 @@
+"""ネイティブのdtypeで保持し、必要に応じてデコードするボリューム"""
+import os
+import tempfile
+import threading
+import weakref
+
+import numpy as np
+
+from pyramid import build_levels
+from volume_stats import VolumeStats
+
+
+def pixel_dtype(ds):
+    """ヘッダ(BitsAllocated / PixelRepresentation)から格納dtypeを求める"""
+    bits = int(getattr(ds, 'BitsAllocated', 16) or 16)
+    signed = int(getattr(ds, 'PixelRepresentation', 0) or 0) == 1
+    size = 1 if bits <= 8 else 2 if bits <= 16 else 4
+    return np.dtype(f"{'i' if signed else 'u'}{size}")
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class DicomVolume:
+    """(z, y, x) のスライスボリューム
+
+    データは格納時のdtypeのまま、メモリ上または ``np.memmap`` の一時ファイル上に
+    置く。スライスの供給元（デコード関数）を登録しておけば、
+    ``volume[z, :, :]`` などでアクセスされた時点で未デコードのスライスだけを
+    デコードする。``decode_on_access`` を False にするとアクセス時のデコードを
+    行わず、未デコードのスライスは0のまま返る（段階表示用）。
+    デコードしたスライスは ``stats``（``VolumeStats``）に集計される。
+    ``geometry`` には読み込み時にスライスの位置情報（``mpr.VolumeGeometry``）を設定する。
+    ``rescale`` は格納値をCT値などに変換する (RescaleSlope, RescaleIntercept) で、
+    ボリューム全体で共通（スライスごとの元の値は ``slice_rescale`` に残す）。
+    """
+
+    def __init__(self, shape, dtype, cache_dir=None, use_memmap=False):
+        shape = tuple(int(n) for n in shape)
+        dtype = np.dtype(dtype)
+        self.cache_path = None
+        self._finalizer = None
+        if use_memmap:
+            fd, self.cache_path = tempfile.mkstemp(prefix="dicom_volume_", suffix=".raw", dir=cache_dir)
+            os.close(fd)
+            self._finalizer = weakref.finalize(self, _remove_file, self.cache_path)
+            data = np.memmap(self.cache_path, dtype=dtype, mode='w+', shape=shape)
+        else:
+            data = np.zeros(shape, dtype=dtype)
+        self._init_state(data, loaded=False)
+
+    def _init_state(self, data, loaded):
+        """データ以外の状態を初期化する（__init__ と from_array で共通）"""
+        self.shape = tuple(int(n) for n in data.shape)
+        self.dtype = data.dtype
+        self._data = data
+        self.decode_on_access = True
+        self._loaded = np.full(self.shape[0], loaded, dtype=bool)
+        self._sources = []  # (開始インデックス, フレーム数, デコード関数)
+        self._source_locks = []
+        self._source_of = np.full(self.shape[0], -1, dtype=np.int64)
+        self.plane_copies = {}
+        self.pyramid = []
+        self.stats = VolumeStats(self.dtype, self.shape[0])
+        self.geometry = None
+        self.slice_rescale = None
+
+    @classmethod
+    def from_array(cls, array, stats=None):
+        """デコード済みの配列からボリュームを作る（コピーしない）
+
+        stats を省略すると、配列全体から統計を集計する。
+        """
+        volume = cls.__new__(cls)
+        volume.cache_path = None
+        volume._finalizer = None
+        volume._init_state(np.asarray(array), loaded=True)
+        if stats is None:
+            volume.stats.add(0, volume._data)
+        else:
+            volume.stats = stats
+        return volume
+
+    @property
+    def rescale(self):
+        return self.stats.rescale
+
+    @rescale.setter
+    def rescale(self, value):
+        self.stats.rescale = (float(value[0]), float(value[1]))
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def add_source(self, start, count, decode):
+        """スライス start から count 枚を返すデコード関数を登録する"""
+        self._source_of[start:start + count] = len(self._sources)
+        self._sources.append((start, count, decode))
+        self._source_locks.append(threading.Lock())
+
+    @property
+    def source_count(self):
+        return len(self._sources)
+
+    def source_span(self, index):
+        """供給元 index の (開始インデックス, フレーム数)"""
+        start, count, _ = self._sources[index]
+        return start, count
+
+    def load_source(self, index):
+        """登録済みの供給元を1つデコードする（デコード済みなら何もしない）"""
+        start, count, decode = self._sources[index]
+        with self._source_locks[index]:
+            if self._loaded[start:start + count].all():
+                return
+            frames = decode()
+            self._data[start:start + count] = frames
+            self.stats.add(start, frames)
+            self._loaded[start:start + count] = True
+
+    def is_loaded(self, index):
+        return bool(self._loaded[index])
+
+    def loaded_count(self):
+        return int(np.count_nonzero(self._loaded))
+
+    def load_range(self, start, stop):
+        """スライス [start, stop) を必要に応じてデコードする"""
+        if self._loaded[start:stop].all():
+            return
+        missing = np.flatnonzero(~self._loaded[start:stop]) + start
+        for index in np.unique(self._source_of[missing]):
+            if index >= 0:
+                self.load_source(int(index))
+
+    def load_all(self):
+        self.load_range(0, self.shape[0])
+
+    def _z_range(self, key):
+        z = key[0] if isinstance(key, tuple) else key
+        if isinstance(z, (int, np.integer)):
+            z = int(z) % self.shape[0]
+            return z, z + 1
+        if isinstance(z, slice):
+            start, stop, _ = z.indices(self.shape[0])
+            return start, max(start, stop)
+        return 0, self.shape[0]
+
+    def __getitem__(self, key):
+        if self.decode_on_access:
+            self.load_range(*self._z_range(key))
+        return self._data[key]
+
+    def __array__(self, dtype=None, copy=None):
+        self.load_all()
+        if dtype is None:
+            return np.asarray(self._data)
+        return np.asarray(self._data, dtype=dtype)
+
+    def build_plane_copies(self, planes=("Sagittal", "Coronal"), max_bytes=None, chunk=32):
+        """断面ごとに連続したメモリ配置のコピーを作る
+
+        (z, y, x) のC順配列では Sagittal/Coronal の取り出しがボリューム全体を
+        跨ぐストライドアクセスになる。``plane_copies["Sagittal"][x]`` が
+        ``volume[:, :, x]``、``plane_copies["Coronal"][y]`` が上下左右反転済みの
+        ``volume[:, y, :]`` と一致するコピーを作り、逐次アクセスで読めるようにする。
+        コピー1枚につきボリュームと同じメモリを使うため、合計が max_bytes を
+        超える断面は作らない。時間がかかるのでバックグラウンドで呼ぶこと。
+        """
+        self.load_all()
+        data = self._data
+        used = sum(copy.nbytes for copy in self.plane_copies.values())
+        for plane in planes:
+            if plane in self.plane_copies:
+                continue
+            if max_bytes is not None and used + self.nbytes > max_bytes:
+                break
+            if plane == "Sagittal":
+                copy = np.empty((self.shape[2], self.shape[0], self.shape[1]), dtype=self.dtype)
+                for z in range(0, self.shape[0], chunk):
+                    copy[:, z:z + chunk, :] = data[z:z + chunk].transpose(2, 0, 1)
+            else:
+                copy = np.empty((self.shape[1], self.shape[0], self.shape[2]), dtype=self.dtype)
+                for z in range(0, self.shape[0], chunk):
+                    block = data[z:z + chunk].transpose(1, 0, 2)[:, :, ::-1]
+                    stop = self.shape[0] - z
+                    copy[:, max(stop - chunk, 0):stop, :] = block[:, ::-1, :]
+            copy.flags.writeable = False
+            self.plane_copies[plane] = copy
+            used += copy.nbytes
+
+    def build_pyramid(self, min_matrix=1024, min_size=256):
+        """y, x が min_matrix 以上なら縮小レベルを作る（バックグラウンドで呼ぶこと）"""
+        if self.pyramid or max(self.shape[1], self.shape[2]) < min_matrix:
+            return
+        self.load_all()
+        self.pyramid = build_levels(self._data, min_size=min_size)
+
+    def drop_plane_copies(self):
+        self.plane_copies = {}
+
+    def close(self):
+        """一時ファイルを使っていれば削除する"""
+        self.plane_copies = {}
+        self.pyramid = []
+        self._data = None
+        if self._finalizer is not None:
+            self._finalizer()
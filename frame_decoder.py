@@ -0,0 +1,70 @@
+"""マルチフレーム・圧縮転送構文のフレーム単位のデコード"""
+from collections import deque
+
+import numpy as np
+import pydicom
+
+try:
+    from pydicom.pixels import iter_pixels
+except ImportError:  # pydicom 2.x はファイル全体をデコードする
+    iter_pixels = None
+
+# マルチフレームのファイルはこの枚数ずつ供給元に分けてデコードする
+FRAME_CHUNK = 8
+
+
+def frame_decode_available():
+    """ファイル全体を読まずにフレーム単位でデコードできるか"""
+    return iter_pixels is not None
+
+
+def frame_chunks(count, chunk=FRAME_CHUNK):
+    """フレーム数 count を (先頭フレーム, 枚数) の並びに分ける"""
+    if not frame_decode_available():
+        return [(0, count)]
+    return [(first, min(chunk, count - first)) for first in range(0, count, chunk)]
+
+
+def decode_frames(path, first=0, count=None):
+    """ファイルのフレーム first から count 枚を (count, 行, 列) の配列で返す
+
+    count を省略するとファイル全体をまとめてデコードする（1フレームのファイルは
+    こちらの方が速い）。フレーム単位のデコードができる場合は、指定した
+    フレームの画素データだけを読んで順にデコードする。
+    """
+    if count is None or iter_pixels is None:
+        pixel_array = pydicom.dcmread(path).pixel_array
+        if pixel_array.ndim == 2:
+            pixel_array = pixel_array[np.newaxis]
+        return pixel_array if count is None else pixel_array[first:first + count]
+    frames = None
+    for i, frame in enumerate(iter_pixels(path, indices=range(first, first + count))):
+        if frames is None:
+            frames = np.empty((count,) + frame.shape, dtype=frame.dtype)
+        frames[i] = frame
+    return frames
+
+
+def ordered_map(executor, fn, items, max_pending, cancelled=None):
+    """items を executor で並列に処理し、投入した順に結果を返す
+
+    同時に処理中（結果を取り出していない）のものは max_pending 個までに
+    抑えるので、デコード結果がメモリに溜まり続けることはない。
+    cancelled（threading.Event）がセットされたら残りは投入しない。
+    """
+    pending = deque()
+    items = iter(items)
+    try:
+        while True:
+            while len(pending) < max_pending and not (cancelled is not None and cancelled.is_set()):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                pending.append(executor.submit(fn, item))
+            if not pending:
+                return
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
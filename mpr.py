@@ -0,0 +1,383 @@
+"""患者座標系のジオメトリに基づく断面再構成（MPR）"""
+import math
+
+import numpy as np
+
+
+def _floats(value, count):
+    try:
+        values = [float(v) for v in value]
+    except (TypeError, ValueError):
+        return None
+    return np.array(values) if len(values) == count else None
+
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def functional_value(ds, sequence, keyword, frame=0):
+    """要素の値（拡張マルチフレームはフレームごと→共通の機能グループ、最後に最上位を見る）"""
+    groups = []
+    per_frame = getattr(ds, 'PerFrameFunctionalGroupsSequence', None)
+    if per_frame and frame < len(per_frame):
+        groups.append(per_frame[frame])
+    shared = getattr(ds, 'SharedFunctionalGroupsSequence', None)
+    if shared:
+        groups.append(shared[0])
+    for group in groups:
+        items = getattr(group, sequence, None)
+        if items:
+            value = getattr(items[0], keyword, None)
+            if value is not None:
+                return value
+    return getattr(ds, keyword, None)
+
+
+def header_slice_spacing(ds):
+    """ヘッダのスライス間隔（SpacingBetweenSlices → SliceThickness → 1mm）"""
+    for keyword in ('SpacingBetweenSlices', 'SliceThickness'):
+        try:
+            value = abs(float(functional_value(ds, 'PixelMeasuresSequence', keyword)))
+        except (TypeError, ValueError):
+            continue
+        if value > 0:
+            return value
+    return 1.0
+
+
+def header_pixel_spacing(ds):
+    """(行間隔, 列間隔) mm。無ければ 1mm"""
+    spacing = _floats(functional_value(ds, 'PixelMeasuresSequence', 'PixelSpacing'), 2)
+    if spacing is None or (spacing <= 0).any():
+        return 1.0, 1.0
+    return float(spacing[0]), float(spacing[1])
+
+
+def header_orientation(ds):
+    orientation = _floats(functional_value(ds, 'PlaneOrientationSequence', 'ImageOrientationPatient'), 6)
+    return orientation if orientation is not None else np.array([1.0, 0, 0, 0, 1, 0])
+
+
+class VolumeGeometry:
+    """(z, y, x) ボリュームの各スライスの位置と画素間隔
+
+    ``row_dir`` は列番号 x が増える向き、``col_dir`` は行番号 y が増える向き、
+    ``normal`` はスライスが並ぶ向き（いずれも患者座標系の単位ベクトル）。
+    ``positions[k]`` はスライス k の ``normal`` 方向の位置(mm)、``shifts[k]`` は
+    面内のずれ (x方向, y方向)(mm) で、ガントリ傾斜があると0以外になる。
+    間隔が均一でずれも無ければ ``regular`` で、配列の添字のまま表示できる。
+    """
+
+    TOLERANCE = 0.01
+
+    def __init__(self, origins, orientation, pixel_spacing, shape):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        orientation = np.asarray(orientation, dtype=np.float64)
+        self.shape = tuple(int(n) for n in shape)
+        self.row_dir = _unit(orientation[:3])
+        self.col_dir = _unit(orientation[3:])
+        self.normal = _unit(np.cross(self.row_dir, self.col_dir))
+        self.dy, self.dx = (float(v) for v in pixel_spacing)
+        self.origin = origins[0]
+        offsets = origins - self.origin
+        positions = offsets @ self.normal
+        if len(positions) > 1 and positions[-1] < positions[0]:
+            # スライスが法線と逆向きに並んでいれば法線を反転して位置を昇順にする
+            self.normal = -self.normal
+            positions = -positions
+        self.positions = positions
+        self.shifts = np.stack([offsets @ self.row_dir, offsets @ self.col_dir], axis=1)
+        gaps = np.diff(positions)
+        self.slice_spacing = float(np.median(gaps)) if len(gaps) and np.median(gaps) > 0 else 1.0
+        self.uniform = bool(len(gaps) == 0 or
+                            (np.abs(gaps - self.slice_spacing) <= self.TOLERANCE * self.slice_spacing).all())
+        self.sheared = bool(np.abs(self.shifts[:, 0]).max() > self.TOLERANCE * self.dx or
+                            np.abs(self.shifts[:, 1]).max() > self.TOLERANCE * self.dy)
+        self.regular = self.uniform and not self.sheared
+
+    @classmethod
+    def from_headers(cls, frames, shape):
+        """(ヘッダ, フレーム数) の一覧（ボリュームの順）から作る"""
+        first = frames[0][0]
+        orientation = header_orientation(first)
+        normal = _unit(np.cross(orientation[:3], orientation[3:]))
+        origins = []
+        for ds, count in frames:
+            position = _floats(functional_value(ds, 'PlanePositionSequence', 'ImagePositionPatient'), 3)
+            if position is None:
+                return cls.from_dataset(first, shape)
+            if count > 1 and getattr(ds, 'PerFrameFunctionalGroupsSequence', None):
+                # 拡張マルチフレームはフレームごとの位置を使う
+                for k in range(count):
+                    frame_position = _floats(functional_value(ds, 'PlanePositionSequence', 'ImagePositionPatient', k), 3)
+                    origins.append(frame_position if frame_position is not None else position)
+                continue
+            spacing = header_slice_spacing(ds)
+            origins.extend(position + k * spacing * normal for k in range(count))
+        return cls(origins, orientation, header_pixel_spacing(first), shape)
+
+    @classmethod
+    def from_dataset(cls, ds, shape):
+        """1つのヘッダから等間隔を仮定して作る（位置情報が無い場合など）"""
+        orientation = header_orientation(ds)
+        normal = _unit(np.cross(orientation[:3], orientation[3:]))
+        position = _floats(functional_value(ds, 'PlanePositionSequence', 'ImagePositionPatient'), 3)
+        position = position if position is not None else np.zeros(3)
+        spacing = header_slice_spacing(ds)
+        origins = [position + k * spacing * normal for k in range(shape[0])]
+        return cls(origins, orientation, header_pixel_spacing(ds), shape)
+
+    def to_arrays(self):
+        """保存用の配列の辞書"""
+        origins = (self.origin + np.outer(self.positions, self.normal) + np.outer(self.shifts[:, 0], self.row_dir)
+                   + np.outer(self.shifts[:, 1], self.col_dir))
+        return {'origins': origins, 'orientation': np.concatenate([self.row_dir, self.col_dir]),
+                'pixel_spacing': np.array([self.dy, self.dx]), 'shape': np.array(self.shape)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['origins'], arrays['orientation'], arrays['pixel_spacing'], arrays['shape'])
+
+    @property
+    def depth_mm(self):
+        return float(self.positions[-1] - self.positions[0])
+
+    def resampled_depth(self):
+        """等間隔に再構成したときの normal 方向の画素数"""
+        return int(round(self.depth_mm / self.slice_spacing)) + 1
+
+    def plane_shape(self, plane):
+        """表示画像の (行, 列)（Sagittal/Coronal は再構成後の行数）"""
+        depth, height, width = self.shape
+        if plane != "Axial" and not self.regular:
+            depth = self.resampled_depth()
+        return {"Axial": (height, width), "Sagittal": (depth, height), "Coronal": (depth, width),
+                "Oblique": None}[plane]
+
+    def aspect(self, plane):
+        """imshow の aspect（1画素の縦と横の長さの比）"""
+        if plane == "Axial":
+            return self.dy / self.dx
+        if plane == "Sagittal":
+            return self.slice_spacing / self.dy
+        if plane == "Coronal":
+            return self.slice_spacing / self.dx
+        return 1.0
+
+    def center(self):
+        """ボリュームの中心（患者座標）"""
+        depth, height, width = self.shape
+        return (self.origin + (width - 1) / 2 * self.dx * self.row_dir + (height - 1) / 2 * self.dy * self.col_dir
+                + (self.positions[0] + self.positions[-1]) / 2 * self.normal)
+
+    def radius(self):
+        """中心からボリュームの角までの距離(mm)"""
+        depth, height, width = self.shape
+        return 0.5 * math.sqrt((width * self.dx) ** 2 + (height * self.dy) ** 2 + self.depth_mm ** 2)
+
+    def to_voxel(self, t, a, b):
+        """原点からの normal 方向 t、x方向 a、y方向 b (mm) を (z, y, x) の連続座標にする
+
+        範囲外の z は -1 になる。
+        """
+        index = np.arange(len(self.positions), dtype=np.float64)
+        if len(index) > 1:
+            z = np.interp(t, self.positions, index, left=-1.0, right=-1.0)
+        else:
+            z = np.where(np.abs(t) <= self.slice_spacing / 2, 0.0, -1.0)
+        if self.sheared:
+            a = a - np.interp(z, index, self.shifts[:, 0])
+            b = b - np.interp(z, index, self.shifts[:, 1])
+        return z, b / self.dy, a / self.dx
+
+
+def trilinear(data, z, y, x, out, fill=0):
+    """(z, y, x) の連続座標で data を三線形補間し、out（data と同じdtype）に書き込む
+
+    範囲外の点は fill にする。data はC順の連続配列であること。
+    """
+    nz, ny, nx = data.shape
+    valid = (z >= 0) & (z <= nz - 1) & (y >= 0) & (y <= ny - 1) & (x >= 0) & (x <= nx - 1)
+    flat = data.reshape(-1)
+    base = np.zeros(z.shape, dtype=np.intp)
+    weights = []
+    steps = []
+    for coord, size, stride in ((z, nz, ny * nx), (y, ny, nx), (x, nx, 1)):
+        clipped = np.clip(coord, 0, size - 1)
+        lower = np.minimum(clipped.astype(np.intp), max(size - 2, 0))
+        base += lower * stride
+        weights.append((clipped - lower).astype(np.float32))
+        steps.append(stride if size > 1 else 0)
+    fz, fy, fx = weights
+    sz, sy, sx = steps
+
+    def lerp_x(offset):
+        left = np.take(flat, base + offset).astype(np.float32)
+        right = np.take(flat, base + offset + sx)
+        return left + (right - left) * fx
+
+    def lerp_y(offset):
+        top = lerp_x(offset)
+        return top + (lerp_x(offset + sy) - top) * fy
+
+    near = lerp_y(0)
+    result = near + (lerp_y(sz) - near) * fz
+    if np.issubdtype(out.dtype, np.integer):
+        np.rint(result, out=result)
+    result[~valid] = fill
+    np.copyto(out, result, casting='unsafe')
+    return out
+
+
+def _volume_data(volume):
+    """補間に使う連続配列（読み込み中は未デコードのスライスが0のまま）"""
+    return np.ascontiguousarray(volume[:])
+
+
+def resample_orthogonal(volume, geometry, plane, index):
+    """スライス間隔が不均一・ずれのあるボリュームの Sagittal/Coronal を等間隔に再構成する
+
+    向きは plane_slice() と同じ（Coronal は上下左右反転）。
+    """
+    depth, height, width = geometry.shape
+    g = geometry
+    rows = g.resampled_depth()
+    if plane == "Sagittal":
+        origin_a, origin_b = index * g.dx, 0.0
+        du, dv = (0.0, g.dy), g.slice_spacing
+        cols, t0 = height, g.positions[0]
+    else:
+        origin_a, origin_b = (width - 1) * g.dx, index * g.dy
+        du, dv = (-g.dx, 0.0), -g.slice_spacing
+        cols, t0 = width, g.positions[-1]
+    j = np.arange(rows, dtype=np.float64)[:, np.newaxis]
+    i = np.arange(cols, dtype=np.float64)[np.newaxis, :]
+    t = np.broadcast_to(t0 + j * dv, (rows, cols))
+    a = np.broadcast_to(origin_a + i * du[0], (rows, cols))
+    b = np.broadcast_to(origin_b + i * du[1], (rows, cols))
+    z, y, x = g.to_voxel(t, a, b)
+    data = _volume_data(volume)
+    out = np.empty((rows, cols), dtype=data.dtype)
+    return trilinear(data, z, y, x, out, fill=_fill_value(volume))
+
+
+def resample_rows(image, geometry, plane, fill=0):
+    """スライス順に並んだ (スライス, 列) の Sagittal/Coronal 画像の行を等間隔に並べ直す
+
+    列方向の面内のずれ（Sagittal は y、Coronal は x）も補正する。向きは反転しない。
+    スラブ投影のように、スライスをまとめた後の画像に使う。
+    """
+    g = geometry
+    index = np.arange(len(g.positions), dtype=np.float64)
+    t = g.positions[0] + np.arange(g.resampled_depth(), dtype=np.float64) * g.slice_spacing
+    z = np.interp(t, g.positions, index)
+    shift, pitch = (g.shifts[:, 1], g.dy) if plane == "Sagittal" else (g.shifts[:, 0], g.dx)
+    x = (np.arange(image.shape[1], dtype=np.float64)[np.newaxis, :]
+         - (np.interp(z, index, shift) / pitch)[:, np.newaxis])
+    z = np.broadcast_to(z[:, np.newaxis], x.shape)
+    data = np.ascontiguousarray(image)[:, np.newaxis, :]
+    out = np.empty(x.shape, dtype=data.dtype)
+    return trilinear(data, z, np.zeros(x.shape), x, out, fill=fill)
+
+
+def _fill_value(volume):
+    stats = getattr(volume, 'stats', None)
+    low = stats.stored_min() if stats is not None else None
+    return low if low is not None else 0
+
+
+def oblique_axes(geometry, angle, tilt):
+    """斜断面の (法線, 横方向 u, 縦方向 v) の単位ベクトル
+
+    angle はスライス面内での回転（0で Sagittal と同じ向き、±90で Coronal の向き）、
+    tilt はスライスの並ぶ向きへの傾き（度）。
+    """
+    g = geometry
+    theta, phi = math.radians(angle), math.radians(tilt)
+    in_plane = math.cos(theta) * g.row_dir + math.sin(theta) * g.col_dir
+    normal = _unit(math.cos(phi) * in_plane + math.sin(phi) * g.normal)
+    u = _unit(-math.sin(theta) * g.row_dir + math.cos(theta) * g.col_dir)
+    v = _unit(np.cross(normal, u))
+    return normal, u, v
+
+
+class Reslicer:
+    """ボリュームから任意の平面を三線形補間で切り出す
+
+    出力は名前付きの再利用バッファ（ボリュームと同じdtype）に書き込むので、
+    平面をドラッグしている間もメモリ確保が繰り返されない。バッファはUIスレッド専用。
+    """
+
+    def __init__(self, volume, geometry, max_size=512):
+        self.volume = volume
+        self.geometry = geometry
+        self.max_size = max_size
+        self._buffers = {}
+
+    def _buffer(self, name, shape, dtype):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def sample(self, origin, u, v, shape, buffer=None):
+        """origin（患者座標）から列ごとに u、行ごとに v (mm) 進む格子で切り出す"""
+        g = self.geometry
+        rows, cols = shape
+        j = np.arange(rows, dtype=np.float64)[:, np.newaxis]
+        i = np.arange(cols, dtype=np.float64)[np.newaxis, :]
+        start = origin - g.origin
+
+        def along(direction):
+            return float(start @ direction) + i * float(u @ direction) + j * float(v @ direction)
+
+        z, y, x = g.to_voxel(along(g.normal), along(g.row_dir), along(g.col_dir))
+        data = _volume_data(self.volume)
+        out = (self._buffer(buffer, shape, data.dtype) if buffer is not None
+               else np.empty(shape, dtype=data.dtype))
+        return trilinear(data, z, y, x, out, fill=_fill_value(self.volume))
+
+    def oblique_steps(self):
+        """斜断面の法線方向の移動量(mm)と、中心からの片側のステップ数"""
+        g = self.geometry
+        step = min(g.dx, g.dy, g.slice_spacing)
+        return step, int(math.ceil(g.radius() / step))
+
+    def oblique_size(self, level=0):
+        """斜断面の出力の1辺の画素数（max_size を上限に level ごとに1/2）"""
+        step, half = self.oblique_steps()
+        return max(min(2 * half, self.max_size) >> level, 2)
+
+    def oblique(self, angle, tilt, offset, level=0, buffer=None):
+        """ボリューム中心から法線方向に offset (mm) ずらした斜断面を切り出す
+
+        出力は1辺 oblique_size(level) の正方形で、画素は等方的。
+        """
+        g = self.geometry
+        normal, u, v = oblique_axes(g, angle, tilt)
+        radius = g.radius()
+        size = self.oblique_size(level)
+        pixel = 2 * radius / (size - 1)
+        center = g.center() + offset * normal
+        origin = center - radius * u - radius * v
+        return self.sample(origin, u * pixel, v * pixel, (size, size), buffer=buffer)
+
+    def axial_intersection(self, angle, tilt, offset, index):
+        """斜断面と Axial スライス index の交線を (a, b, c)（a*x + b*y + c = 0）で返す
+
+        交わらない（平行な）場合は None。
+        """
+        g = self.geometry
+        normal, _, _ = oblique_axes(g, angle, tilt)
+        point = g.center() + offset * normal
+        slice_origin = g.origin + g.positions[index] * g.normal
+        if g.sheared:
+            slice_origin = slice_origin + g.shifts[index, 0] * g.row_dir + g.shifts[index, 1] * g.col_dir
+        a = g.dx * float(normal @ g.row_dir)
+        b = g.dy * float(normal @ g.col_dir)
+        if abs(a) < 1e-9 and abs(b) < 1e-9:
+            return None
+        return a, b, float(normal @ (slice_origin - point))
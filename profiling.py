@@ -0,0 +1,116 @@
+"""描画と読み込みの各段階の所要時間を記録するプロファイラ"""
+import csv
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+TRACE_FIELDS = ('start_s', 'stage', 'ms', 'thread')
+
+
+class Profiler:
+    """段階ごとの所要時間を直近 history 件ずつ保持し、百分位点を求める
+
+    ``with profiler.measure("display.window"):`` のように囲むか、
+    ``record()`` で直接記録する。記録は時刻付きのトレースとしても保持し、
+    ``dump()`` で JSON / CSV に書き出せる。どのスレッドからでも呼べる。
+    """
+
+    def __init__(self, history=1000, trace_size=20000):
+        self.enabled = True
+        self.history = history
+        self._samples = {}  # 段階 -> deque[(開始時刻, 秒)]
+        self._counts = {}
+        self._trace = deque(maxlen=trace_size)
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def measure(self, stage):
+        """with ブロックの所要時間を stage として記録する"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, start)
+
+    def record(self, stage, seconds, start=None):
+        if not self.enabled:
+            return
+        if start is None:
+            start = time.perf_counter() - seconds
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.history)
+                self._counts[stage] = 0
+            samples.append((start, seconds))
+            self._counts[stage] += 1
+            self._trace.append((start - self._origin, stage, seconds * 1000, threading.current_thread().name))
+
+    def stats(self, stages=None):
+        """段階ごとの件数と、直近の所要時間(ms)の平均・p50/p95/p99・最大"""
+        with self._lock:
+            names = sorted(self._samples) if stages is None else [s for s in stages if s in self._samples]
+            snapshot = {name: [seconds for _, seconds in self._samples[name]] for name in names}
+            counts = {name: self._counts[name] for name in names}
+        result = {}
+        for name, seconds in snapshot.items():
+            ms = np.asarray(seconds) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            result[name] = {
+                'count': counts[name],
+                'last_ms': float(ms[-1]),
+                'mean_ms': float(ms.mean()),
+                'p50_ms': float(p50),
+                'p95_ms': float(p95),
+                'p99_ms': float(p99),
+                'max_ms': float(ms.max()),
+            }
+        return result
+
+    def rate(self, stage, window=1.0):
+        """直近 window 秒間に stage が完了した回数/秒（描画ならFPS）"""
+        now = time.perf_counter()
+        count = 0
+        with self._lock:
+            for start, seconds in reversed(self._samples.get(stage, ())):
+                if now - (start + seconds) > window:
+                    break
+                count += 1
+        return count / window
+
+    def trace(self):
+        """記録順のトレース（開始時刻は生成時からの秒）"""
+        with self._lock:
+            events = list(self._trace)
+        return [dict(zip(TRACE_FIELDS, event)) for event in events]
+
+    def dump(self, path):
+        """拡張子が .csv ならトレースをCSVで、それ以外は統計とトレースをJSONで書き出す"""
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=TRACE_FIELDS)
+                writer.writeheader()
+                writer.writerows(self.trace())
+            return
+        report = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'stats': self.stats(),
+            'trace': self.trace(),
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._trace.clear()
+            self._origin = time.perf_counter()
@@ -0,0 +1,46 @@
+"""大きなマトリクス向けの多重解像度ピラミッド"""
+import numpy as np
+
+
+def downsample_2x(block):
+    """最後の2軸を2×2の平均で半分にした float32 の配列を返す（奇数の最後の行・列は捨てる）"""
+    rows, cols = block.shape[-2] // 2 * 2, block.shape[-1] // 2 * 2
+    block = block[..., :rows, :cols].astype(np.float32)
+    reduced = block.reshape(block.shape[:-2] + (rows // 2, 2, cols // 2, 2)).mean(axis=(-3, -1))
+    return reduced
+
+
+def build_levels(data, min_size=256, chunk=32):
+    """(z, y, x) ボリュームの y, x を1/2ずつ縮小したレベルの一覧を作る
+
+    z方向は縮小しないので、各レベルのスライス番号は元のボリュームと同じ。
+    短辺が min_size を下回るレベルは作らない。
+    """
+    levels = []
+    current = data
+    while min(current.shape[1], current.shape[2]) // 2 >= min_size:
+        level = np.empty((current.shape[0], current.shape[1] // 2, current.shape[2] // 2), dtype=data.dtype)
+        for z in range(0, current.shape[0], chunk):
+            reduced = downsample_2x(current[z:z + chunk])
+            if np.issubdtype(data.dtype, np.integer):
+                reduced = np.rint(reduced)
+            level[z:z + chunk] = reduced
+        level.flags.writeable = False
+        levels.append(level)
+        current = level
+    return levels
+
+
+def choose_level(shape, panel_size, levels, reducible=(True, True)):
+    """表示先のピクセル数を下回らない範囲で最も粗いレベルを選ぶ
+
+    shape は元解像度での表示画像の (行, 列)、panel_size は表示先の
+    (高さ, 幅) ピクセル数。reducible はピラミッドで縮小される軸。
+    """
+    level = 0
+    while level < levels:
+        scale = 2 ** (level + 1)
+        if any(r and n // scale < p for n, p, r in zip(shape, panel_size, reducible)):
+            break
+        level += 1
+    return level
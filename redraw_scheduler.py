@@ -0,0 +1,73 @@
+"""スライダー操作による再描画要求をまとめるスケジューラ"""
+import time
+from collections import deque
+
+
+class RedrawScheduler:
+    """再描画要求を1フレームあたり最大1回の描画にまとめる
+
+    ``request()`` は何度呼ばれても、次の描画が予約済みであれば何もしない
+    （その要求は間引かれた数として数える）。描画は ``root.after`` で
+    前回の描画から ``1 / fps`` 秒以上空けて実行され、実行時点の最新の
+    状態を描くため、操作の最後の状態は必ず表示される。
+    """
+
+    def __init__(self, root, render, fps=60, history=240):
+        self.root = root
+        self.render = render
+        self.frame_interval = 1.0 / fps
+        self.requests = 0
+        self.frames = 0
+        self.dropped = 0
+        self.render_times = deque(maxlen=history)
+        self._pending = None
+        self._last_render = 0.0
+
+    def request(self, *args):
+        """再描画を要求する（Scaleのcommandにそのまま渡せる）"""
+        self.requests += 1
+        if self._pending is not None:
+            self.dropped += 1
+            return
+        wait = self._last_render + self.frame_interval - time.perf_counter()
+        self._pending = self.root.after(max(int(wait * 1000), 1), self._run)
+
+    def _run(self):
+        self._pending = None
+        start = time.perf_counter()
+        try:
+            self.render()
+        finally:
+            end = time.perf_counter()
+            self._last_render = end
+            self.frames += 1
+            self.render_times.append(end - start)
+
+    def flush(self):
+        """予約中の描画があればすぐに実行する"""
+        if self._pending is not None:
+            self.root.after_cancel(self._pending)
+            self._run()
+
+    def cancel(self):
+        if self._pending is not None:
+            self.root.after_cancel(self._pending)
+            self._pending = None
+
+    def stats(self):
+        """描画回数・間引いた要求数・描画時間(ms)の統計"""
+        times = sorted(self.render_times)
+        return {
+            'requests': self.requests,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'last_ms': self.render_times[-1] * 1000 if times else 0.0,
+            'mean_ms': sum(times) / len(times) * 1000 if times else 0.0,
+            'max_ms': times[-1] * 1000 if times else 0.0,
+        }
+
+    def reset_stats(self):
+        self.requests = 0
+        self.frames = 0
+        self.dropped = 0
+        self.render_times.clear()
@@ -0,0 +1,171 @@
+"""デコード済みシリーズのディスクキャッシュ"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset
+
+from dicom_volume import DicomVolume
+from mpr import VolumeGeometry
+from volume_stats import VolumeStats
+
+CACHE_VERSION = 4
+
+# update_image_info と表示処理で参照するヘッダ項目
+HEADER_KEYWORDS = (
+    'StudyInstanceUID', 'SeriesInstanceUID', 'Rows', 'Columns',
+    'BitsAllocated', 'BitsStored', 'PixelRepresentation',
+    'PixelSpacing', 'SliceThickness', 'SpacingBetweenSlices',
+    'ImagePositionPatient', 'ImageOrientationPatient',
+    'RescaleSlope', 'RescaleIntercept', 'WindowWidth', 'WindowCenter',
+    'PatientName', 'PatientID', 'PatientSex', 'PatientBirthDate', 'PatientAge',
+    'StudyDate', 'BodyPartExamined', 'Modality', 'Manufacturer', 'ManufacturerModelName',
+)
+
+
+def default_cache_dir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'dicom_viewer', 'series')
+
+
+def header_subset(ds):
+    """キャッシュに保存するヘッダ項目だけを取り出す"""
+    subset = Dataset()
+    for keyword in HEADER_KEYWORDS:
+        if keyword in ds:
+            subset.add(ds.data_element(keyword))
+    return subset
+
+
+class SeriesCache:
+    """フォルダ・ファイルのmtime/サイズ・SeriesInstanceUIDをキーにしたLRUキャッシュ
+
+    各エントリは ``volume.npy``（メモリマップで開ける）と ``header.json``、
+    ``meta.json``、統計の ``stats.npz``、位置情報の ``geometry.npz`` を持つディレクトリで、合計サイズが ``max_bytes`` を超えると
+    最後に使われた時刻が古いものから削除する。
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=4 * 1024 ** 3):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def key_for(self, folder_path, file_paths):
+        """キャッシュキーを計算する（ファイルが読めなければ None）"""
+        if not file_paths:
+            return None
+        folder_path = os.path.abspath(folder_path)
+        digest = hashlib.sha256(f"v{CACHE_VERSION}\0{folder_path}".encode('utf-8'))
+        try:
+            for path in sorted(file_paths):
+                st = os.stat(path)
+                rel = os.path.relpath(path, folder_path)
+                digest.update(f"\0{rel}\0{st.st_mtime_ns}\0{st.st_size}".encode('utf-8'))
+            ds = pydicom.dcmread(sorted(file_paths)[0], stop_before_pixels=True,
+                                 specific_tags=['SeriesInstanceUID'])
+        except Exception as e:
+            print(f"警告: キャッシュキーを計算できませんでした: {e}")
+            return None
+        digest.update(str(getattr(ds, 'SeriesInstanceUID', '')).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """キャッシュ済みなら (DicomVolume, ヘッダ) を返す"""
+        if key is None:
+            return None
+        entry = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != CACHE_VERSION:
+                return None
+            with open(os.path.join(entry, 'header.json'), encoding='utf-8') as f:
+                dicom_data = Dataset.from_json(json.load(f))
+            array = np.load(os.path.join(entry, 'volume.npy'), mmap_mode='r')
+            stats = None
+            if os.path.exists(os.path.join(entry, 'stats.npz')):
+                with np.load(os.path.join(entry, 'stats.npz')) as arrays:
+                    stats = VolumeStats.from_arrays(array.dtype, arrays)
+            geometry = None
+            if os.path.exists(os.path.join(entry, 'geometry.npz')):
+                with np.load(os.path.join(entry, 'geometry.npz')) as arrays:
+                    geometry = VolumeGeometry.from_arrays(arrays)
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            # 最後に使われた時刻として更新する（読み取り専用や削除済みなら更新しない）
+            os.utime(os.path.join(entry, 'meta.json'))
+        except OSError:
+            pass
+        volume = DicomVolume.from_array(array, stats=stats)
+        volume.geometry = geometry
+        volume.rescale = meta.get('rescale', (1.0, 0.0))
+        if meta.get('slice_rescale') is not None:
+            volume.slice_rescale = np.array(meta['slice_rescale'], dtype=np.float64)
+        return volume, dicom_data
+
+    def store(self, key, volume, dicom_data, file_count):
+        """ボリュームとヘッダを保存し、上限を超えた分を削除する"""
+        if key is None:
+            return
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = tempfile.mkdtemp(prefix='.tmp_', dir=self.cache_dir)
+            array = np.asarray(volume)
+            np.save(os.path.join(tmp, 'volume.npy'), array)
+            np.savez(os.path.join(tmp, 'stats.npz'), **volume.stats.to_arrays())
+            if volume.geometry is not None:
+                np.savez(os.path.join(tmp, 'geometry.npz'), **volume.geometry.to_arrays())
+            with open(os.path.join(tmp, 'header.json'), 'w', encoding='utf-8') as f:
+                json.dump(header_subset(dicom_data).to_json_dict(), f)
+            meta = {
+                'version': CACHE_VERSION,
+                'shape': list(array.shape),
+                'dtype': array.dtype.str,
+                'file_count': file_count,
+                'rescale': list(volume.rescale),
+                'slice_rescale': None if volume.slice_rescale is None else volume.slice_rescale.tolist(),
+                'created': time.time(),
+            }
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp, entry)
+        except Exception as e:
+            print(f"警告: キャッシュを書き込めませんでした: {e}")
+            if 'tmp' in locals():
+                shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        """(最終使用時刻, サイズ, パス) の一覧"""
+        result = []
+        if not os.path.isdir(self.cache_dir):
+            return result
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry, 'meta.json')
+            if name.startswith('.') or not os.path.isfile(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            result.append((os.path.getmtime(meta_path), size, entry))
+        return result
+
+    def evict(self):
+        """合計サイズが上限以下になるまで古いエントリを削除する"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -0,0 +1,237 @@
+"""フォルダ内のDICOMファイルをヘッダだけ読んでシリーズごとに索引化する"""
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pydicom
+
+from dicom_loader import default_worker_count, frame_count, is_dicom_file
+
+INDEX_VERSION = 1
+
+# 索引に必要なヘッダ項目（画素データや他の要素は読まない）
+INDEX_KEYWORDS = [
+    'StudyInstanceUID', 'SeriesInstanceUID', 'SeriesNumber', 'SeriesDescription',
+    'StudyDate', 'StudyDescription', 'PatientName', 'Modality',
+    'ImagePositionPatient', 'ImageOrientationPatient', 'Rows', 'Columns', 'NumberOfFrames',
+]
+
+COLUMNS = ('path', 'mtime_ns', 'size', 'is_dicom', 'study_uid', 'series_uid', 'series_number',
+           'series_description', 'study_date', 'study_description', 'patient_name', 'modality',
+           'rows', 'cols', 'frames', 'orientation')
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER,
+    is_dicom INTEGER,
+    study_uid TEXT,
+    series_uid TEXT,
+    series_number INTEGER,
+    series_description TEXT,
+    study_date TEXT,
+    study_description TEXT,
+    patient_name TEXT,
+    modality TEXT,
+    rows INTEGER,
+    cols INTEGER,
+    frames INTEGER,
+    orientation TEXT
+);
+PRAGMA user_version = {INDEX_VERSION};
+"""
+
+
+def default_index_path():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'dicom_viewer', 'index.sqlite3')
+
+
+def _text(ds, keyword):
+    value = getattr(ds, keyword, None)
+    return '' if value is None else str(value)
+
+
+def _orientation_key(ds):
+    """方向ベクトルを丸めた文字列（スカウト像など向きの違う画像を分けるため）"""
+    orientation = getattr(ds, 'ImageOrientationPatient', None)
+    if orientation is None or len(orientation) != 6:
+        return ''
+    return ','.join(f"{float(v):.2f}" for v in orientation)
+
+
+def index_record(path, st):
+    """1ファイルのヘッダを読んで索引の行を作る（DICOMでなければ is_dicom=0）"""
+    record = dict.fromkeys(COLUMNS)
+    record.update(path=path, mtime_ns=st.st_mtime_ns, size=st.st_size, is_dicom=0)
+    if not is_dicom_file(path):
+        return record
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=INDEX_KEYWORDS, force=True)
+        if 'Rows' not in ds:
+            # 画像を持たないDICOM（DICOMDIRや構造化レポートなど）
+            return record
+        number = getattr(ds, 'SeriesNumber', None)
+        record.update(
+            is_dicom=1,
+            study_uid=_text(ds, 'StudyInstanceUID'),
+            series_uid=_text(ds, 'SeriesInstanceUID'),
+            series_number=int(number) if number not in (None, '') else None,
+            series_description=_text(ds, 'SeriesDescription'),
+            study_date=_text(ds, 'StudyDate'),
+            study_description=_text(ds, 'StudyDescription'),
+            patient_name=_text(ds, 'PatientName'),
+            modality=_text(ds, 'Modality'),
+            rows=int(ds.Rows),
+            cols=int(getattr(ds, 'Columns', 0) or 0),
+            frames=frame_count(ds),
+            orientation=_orientation_key(ds),
+        )
+    except Exception as e:
+        print(f"警告: {path} のヘッダを読み込めませんでした: {e}")
+    return record
+
+
+class SeriesIndex:
+    """ファイルのパス・mtime・サイズと索引用ヘッダを保存するSQLiteの索引
+
+    ``scan()`` はフォルダを走査し、索引に無いファイルと mtime/サイズが
+    変わったファイルのヘッダだけを並列に読み直す。結果は
+    StudyInstanceUID / SeriesInstanceUID ごと（さらにマトリクスと向きが
+    違う画像は別）にまとめたシリーズの一覧で返す。索引ファイルを作れない
+    場合はメモリ上の索引で動作する。
+    """
+
+    BATCH = 256
+
+    def __init__(self, db_path=None, max_workers=None):
+        self.db_path = db_path or default_index_path()
+        self.max_workers = max_workers or default_worker_count()
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = self._connect(self.db_path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"警告: 索引ファイルを開けませんでした（メモリ上で索引化します）: {e}")
+            self._conn = self._connect(':memory:')
+
+    @staticmethod
+    def _connect(path):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        if conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            conn.execute("DROP TABLE IF EXISTS files")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _known(self, folder):
+        """folder 以下の索引済みファイルの {パス: (mtime_ns, サイズ)}"""
+        low, high = folder + os.sep, folder + chr(ord(os.sep) + 1)
+        with self._lock:
+            rows = self._conn.execute("SELECT path, mtime_ns, size FROM files WHERE path >= ? AND path < ?",
+                                      (low, high)).fetchall()
+        return {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+    def _write(self, records):
+        placeholders = ', '.join('?' * len(COLUMNS))
+        with self._lock, self._conn:
+            self._conn.executemany(f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                                   [tuple(r[c] for c in COLUMNS) for r in records])
+
+    def _delete(self, paths):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+
+    def scan(self, folder, progress=None, cancelled=None):
+        """folder を索引化してシリーズの一覧を返す
+
+        progress(済み, 総数) は変更のあったファイルを読むたびに呼ばれる。
+        cancelled（threading.Event）がセットされたら途中で打ち切り None を返す。
+        """
+        folder = os.path.abspath(folder)
+        known = self._known(folder)
+        current = {}
+        for root, dirs, files in os.walk(folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    current[path] = os.stat(path)
+                except OSError:
+                    continue
+        removed = [path for path in known if path not in current]
+        if removed:
+            self._delete(removed)
+        changed = [(path, st) for path, st in current.items()
+                   if known.get(path) != (st.st_mtime_ns, st.st_size)]
+        done = 0
+        if progress is not None:
+            progress(done, len(changed))
+
+        def read(item):
+            if cancelled is not None and cancelled.is_set():
+                return None
+            return index_record(*item)
+
+        if changed:
+            batch = []
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for record in executor.map(read, changed):
+                    if record is None:
+                        continue
+                    batch.append(record)
+                    done += 1
+                    if len(batch) >= self.BATCH:
+                        self._write(batch)
+                        batch = []
+                        if progress is not None:
+                            progress(done, len(changed))
+            # 打ち切った場合も読み終えた分は索引に残す
+            self._write(batch)
+            if cancelled is not None and cancelled.is_set():
+                return None
+        if progress is not None:
+            progress(done, len(changed))
+        return self.series(folder)
+
+    def series(self, folder):
+        """索引済みの folder 以下の画像をシリーズごとにまとめる
+
+        各シリーズは 'files'（パスの一覧）と表示用のヘッダ項目を持つ辞書。
+        同じシリーズでもマトリクスや向きが異なる画像は別のシリーズにする。
+        """
+        folder = os.path.abspath(folder)
+        low, high = folder + os.sep, folder + chr(ord(os.sep) + 1)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM files WHERE is_dicom = 1 AND path >= ? AND path < ? "
+                "ORDER BY path", (low, high)).fetchall()
+        groups = {}
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            key = (record['study_uid'], record['series_uid'], record['rows'], record['cols'], record['orientation'])
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    'study_uid': record['study_uid'],
+                    'series_uid': record['series_uid'],
+                    'series_number': record['series_number'],
+                    'series_description': record['series_description'],
+                    'study_date': record['study_date'],
+                    'study_description': record['study_description'],
+                    'patient_name': record['patient_name'],
+                    'modality': record['modality'],
+                    'rows': record['rows'],
+                    'cols': record['cols'],
+                    'frames': 0,
+                    'files': [],
+                }
+            group['frames'] += record['frames'] or 1
+            group['files'].append(record['path'])
+        return sorted(groups.values(),
+                      key=lambda g: (g['study_date'], g['study_uid'],
+                                     g['series_number'] if g['series_number'] is not None else -1,
+                                     g['series_uid'], -g['frames']))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,200 @@
+"""厚みのあるスラブの最大値・最小値・平均値投影（MIP / MinIP / Average）"""
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+
+from mpr import resample_rows
+from slice_cache import plane_slice
+
+SLAB_MODES = ("MIP", "MinIP", "Average")
+
+
+class SlabProjector:
+    """1つの断面方向のスラブ投影を、スラブの移動に合わせて差分更新する
+
+    ``source(index)`` はその断面方向の index 枚目の2D画像を返す関数。
+    スラブが前回の位置から少しだけ動いた場合は、入ってきたスライスを
+    加え、出ていったスライスを除くだけで投影を更新する。MIP / MinIP は
+    画素ごとに最大（最小）値を与えたスライス番号を持ち、出ていくスライスが
+    最大値だった画素だけをスラブ内から求め直す。
+    大きく動いた場合は ``BLOCK`` 枚ごとのブロックの投影（LRUで保持）を
+    組み合わせて作り直すので、厚いスラブでも読み込むスライスは少なくて済む。
+    ``finish`` を渡すと投影結果に適用してから返す。UIスレッド専用。
+    """
+
+    BLOCK = 8
+
+    def __init__(self, source, mode, finish=None, block_bytes=64 * 1024 * 1024):
+        if mode not in SLAB_MODES:
+            raise ValueError(f"未対応の投影です: {mode}")
+        self.source = source
+        self.mode = mode
+        self.finish = finish
+        self.block_bytes = block_bytes
+        self._blocks = OrderedDict()
+        self._blocks_nbytes = 0
+        self.reset()
+
+    def reset(self):
+        """保持している投影とブロックを捨てる（元データが変わったときに呼ぶ）"""
+        self.start = self.stop = 0
+        self._value = None
+        self._arg = None
+        self._blocks.clear()
+        self._blocks_nbytes = 0
+
+    def project(self, start, stop):
+        """スライス start〜stop-1 の投影を返す（次の呼び出しまで有効）"""
+        if stop <= start:
+            raise ValueError("スラブが空です")
+        if self._value is None or abs(start - self.start) + abs(stop - self.stop) >= stop - start:
+            self._rebuild(start, stop)
+        else:
+            self._slide(start, stop)
+        result = self._result()
+        return self.finish(result) if self.finish is not None else result
+
+    def _result(self):
+        if self.mode != "Average":
+            return self._value
+        mean = self._value / (self.stop - self.start)
+        if self._dtype.kind in 'iu':
+            return np.rint(mean).astype(self._dtype)
+        return mean.astype(np.float32)
+
+    # 差分更新
+
+    def _slide(self, start, stop):
+        # 先に広げてから縮めるので、途中でスラブが空になることはない
+        while self.stop < stop:
+            self.stop += 1
+            self._add(self.stop - 1)
+        while self.start > start:
+            self.start -= 1
+            self._add(self.start)
+        while self.start < start:
+            self.start += 1
+            self._drop(self.start - 1)
+        while self.stop > stop:
+            self.stop -= 1
+            self._drop(self.stop)
+
+    def _add(self, index):
+        image = self.source(index)
+        if self.mode == "Average":
+            self._value += image
+            return
+        better = self._better(image, self._value)
+        np.copyto(self._value, image, where=better)
+        np.copyto(self._arg, index, where=better)
+
+    def _better(self, a, b):
+        # 同じ値なら後から来たスライスを採る（平坦な背景で求め直しが続かないように）
+        return a >= b if self.mode == "MIP" else a <= b
+
+    def _drop(self, index):
+        if self.mode == "Average":
+            self._value -= self.source(index)
+            return
+        pixels = np.flatnonzero(self._arg == index)
+        if not len(pixels):
+            return
+        if len(pixels) * 4 > self._arg.size:
+            # 大半の画素が入れ替わる場合はブロックから作り直す方が速い
+            self._rebuild(self.start, self.stop)
+            return
+        best = None
+        for k in range(self.start, self.stop):
+            values = np.take(self.source(k), pixels)
+            if best is None:
+                best, arg = values, np.full(values.shape, k, dtype=self._arg.dtype)
+                continue
+            better = self._better(values, best)
+            np.copyto(best, values, where=better)
+            np.copyto(arg, k, where=better)
+        np.put(self._value, pixels, best)
+        np.put(self._arg, pixels, arg)
+
+    # 作り直し
+
+    def _rebuild(self, start, stop):
+        first_block = -(-start // self.BLOCK)
+        last_block = stop // self.BLOCK
+        parts = []
+        if last_block - first_block >= 2:
+            parts.extend(range(start, first_block * self.BLOCK))
+            parts.extend(('block', b) for b in range(first_block, last_block))
+            parts.extend(range(last_block * self.BLOCK, stop))
+        else:
+            parts.extend(range(start, stop))
+        self._value = self._arg = None
+        for part in parts:
+            if isinstance(part, tuple):
+                value, arg = self._block(part[1])
+            else:
+                value, arg = self._single(part)
+            self._merge(value, arg)
+        self.start, self.stop = start, stop
+
+    def _single(self, index):
+        image = np.asarray(self.source(index))
+        self._dtype = image.dtype
+        if self.mode == "Average":
+            return image, None
+        return image, index
+
+    def _merge(self, value, arg):
+        if self._value is None:
+            if self.mode == "Average":
+                self._value = value.astype(np.int64 if value.dtype.kind in 'iub' else np.float64)
+            else:
+                self._value = np.array(value)
+                self._arg = np.empty(value.shape, dtype=np.int32)
+                self._arg[...] = arg
+            return
+        if self.mode == "Average":
+            self._value += value
+            return
+        better = self._better(value, self._value)
+        np.copyto(self._value, value, where=better)
+        np.copyto(self._arg, arg, where=better)
+
+    def _block(self, block):
+        cached = self._blocks.get(block)
+        if cached is not None:
+            self._blocks.move_to_end(block)
+            return cached
+        saved = self._value, self._arg
+        self._value = self._arg = None
+        for index in range(block * self.BLOCK, (block + 1) * self.BLOCK):
+            self._merge(*self._single(index))
+        entry = (self._value, self._arg)
+        self._value, self._arg = saved
+        self._blocks[block] = entry
+        self._blocks_nbytes += sum(a.nbytes for a in entry if a is not None)
+        while self._blocks_nbytes > self.block_bytes and len(self._blocks) > 1:
+            _, evicted = self._blocks.popitem(last=False)
+            self._blocks_nbytes -= sum(a.nbytes for a in evicted if a is not None)
+        return entry
+
+
+def plane_projector(volume, plane, mode):
+    """volume の plane 方向（Axial / Sagittal / Coronal）のスラブ投影を作る
+
+    スライス間隔が不均一かずれのあるボリュームの Sagittal/Coronal は、
+    元の並びのまま投影してから行を等間隔に並べ直す（スラブの厚み方向の
+    ずれは補正しない）。
+    """
+    geometry = getattr(volume, 'geometry', None)
+    if plane == "Axial" or geometry is None or geometry.regular:
+        return SlabProjector(partial(plane_slice, volume, plane), mode)
+
+    def finish(image):
+        low = volume.stats.stored_min() if getattr(volume, 'stats', None) is not None else None
+        image = resample_rows(image, geometry, plane, fill=low if low is not None else 0)
+        return image if plane == "Sagittal" else np.flipud(np.fliplr(image))
+
+    if plane == "Sagittal":
+        return SlabProjector(lambda index: volume[:, :, index], mode, finish=finish)
+    return SlabProjector(lambda index: volume[:, index, :], mode, finish=finish)
@@ -0,0 +1,149 @@
+"""ウィンドウ処理済みスライスのLRUキャッシュと先読み"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from mpr import resample_orthogonal
+
+
+def plane_slice(volume, plane, index, level=0):
+    """指定した断面のスライスを表示向きで取り出す
+
+    ボリュームに断面ごとの連続コピー（plane_copies）があればそちらから読む。
+    level > 0 の場合はピラミッドの縮小レベルから読む（index は元解像度の番号）。
+    スライス間隔が不均一かずれのあるボリュームの Sagittal/Coronal は、
+    位置情報に従って等間隔に再構成する（この場合 level は使わない）。
+    """
+    geometry = getattr(volume, 'geometry', None)
+    if plane != "Axial" and geometry is not None and not geometry.regular:
+        return resample_orthogonal(volume, geometry, plane, index)
+    if level:
+        data = volume.pyramid[level - 1]
+        if plane == "Axial":
+            return data[index]
+        # 奇数の行・列は縮小時に落ちるので、最後の番号はレベルの範囲内に収める
+        if plane == "Sagittal":
+            return data[:, :, min(index >> level, data.shape[2] - 1)]
+        return np.flipud(np.fliplr(data[:, min(index >> level, data.shape[1] - 1), :]))
+    copies = getattr(volume, 'plane_copies', None)
+    if copies and plane in copies:
+        return copies[plane][index]
+    if plane == "Axial":
+        return volume[index, :, :]
+    if plane == "Sagittal":
+        return volume[:, :, index]
+    return np.flipud(np.fliplr(volume[:, index, :]))
+
+
+def plane_size(shape, plane):
+    """断面方向のスライス数"""
+    return {"Axial": shape[0], "Sagittal": shape[2], "Coronal": shape[1]}[plane]
+
+
+class SliceCache:
+    """(世代, 断面, インデックス, レベル, WW, WL) をキーにしたuint8スライスのLRUキャッシュ
+
+    合計サイズが ``max_bytes`` を超えると古いものから捨てる。UIスレッドと
+    先読みスレッドの両方から使うためロックで保護している。
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def get(self, key):
+        with self._lock:
+            image = self._items.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        image.flags.writeable = False
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._items[key] = image
+            self.nbytes += image.nbytes
+            while self.nbytes > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+class SlicePrefetcher:
+    """カーソルの移動方向の先にあるスライスをバックグラウンドでキャッシュに詰める
+
+    ``schedule()`` で現在位置を渡すたびに先読み対象が置き換わり、古い
+    先読みは途中で打ち切られる。
+    """
+
+    def __init__(self, cache, window, ahead=8):
+        self.cache = cache
+        self.window = window  # (画像, WW, WL) -> uint8画像
+        self.ahead = ahead
+        self._job = None
+        self._generation = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, volume, volume_generation, targets, ww, wl):
+        """targets は (断面, インデックス, 方向, ピラミッドレベル) のリスト"""
+        with self._condition:
+            self._generation += 1
+            self._job = (self._generation, volume, volume_generation, list(targets), ww, wl)
+            self._condition.notify()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+
+    def cancel(self):
+        with self._condition:
+            self._generation += 1
+            self._job = None
+
+    def _current(self, generation):
+        return generation == self._generation
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while self._job is None:
+                    self._condition.wait()
+                job = self._job
+                self._job = None
+            generation, volume, volume_generation, targets, ww, wl = job
+            try:
+                self._prefetch(generation, volume, volume_generation, targets, ww, wl)
+            except Exception as e:
+                print(f"警告: スライスの先読みに失敗しました: {e}")
+
+    def _prefetch(self, generation, volume, volume_generation, targets, ww, wl):
+        for step in range(1, self.ahead + 1):
+            for plane, index, direction, level in targets:
+                if not self._current(generation):
+                    return
+                target = index + direction * step
+                if not 0 <= target < plane_size(volume.shape, plane):
+                    continue
+                key = (volume_generation, plane, target, level, ww, wl)
+                if key in self.cache:
+                    continue
+                self.cache.put(key, self.window(plane_slice(volume, plane, target, level), ww, wl))
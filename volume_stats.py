@@ -0,0 +1,194 @@
+"""デコード時に集計するスライスごとの統計とヒストグラム"""
+import threading
+
+import numpy as np
+
+# (名前, 下側パーセンタイル, 上側パーセンタイル)
+AUTO_WINDOW_PRESETS = (
+    ("最小-最大", 0.0, 100.0),
+    ("0.5-99.5%", 0.5, 99.5),
+    ("1-99%", 1.0, 99.0),
+    ("5-95%", 5.0, 95.0),
+)
+
+SAMPLES_PER_SLICE = 4096
+
+# 度数は縦横4画素ごとに数える（ウィンドウ決定には十分な精度で、デコードへの負荷を抑える）
+HISTOGRAM_STRIDE = 4
+
+
+class VolumeStats:
+    """スライスを書き込むたびに min/max とヒストグラムを統合していく統計
+
+    16ビット以下の整数dtypeは格納値ごとの度数（``np.bincount``）を
+    足し合わせ、それ以外のdtypeはスライスごとに間引いた画素を保持して
+    パーセンタイルを求める。min/max はスライスごとに正確な値を持つ。
+    ボリューム全体を読み直すことはない。``add()`` はどのスレッドからでも呼べる。
+    集計は格納値で行い、``min()`` / ``percentile()`` / ``histogram()`` などは
+    ``rescale``（RescaleSlope, RescaleIntercept）を適用したCT値などの単位で返す
+    （傾きは正とする）。
+    """
+
+    def __init__(self, dtype, slice_count):
+        self.dtype = np.dtype(dtype)
+        self.binned = self.dtype.kind in 'iu' and self.dtype.itemsize <= 2
+        self.offset = int(np.iinfo(self.dtype).min) if self.binned else 0
+        self.counts = np.zeros(2 ** (8 * self.dtype.itemsize), dtype=np.int64) if self.binned else None
+        self.samples = {}
+        self.slice_min = np.full(slice_count, np.nan)
+        self.slice_max = np.full(slice_count, np.nan)
+        self.rescale = (1.0, 0.0)
+        self._lock = threading.Lock()
+
+    def add(self, start, frames):
+        """スライス start から始まる (n, y, x) のフレームを統計に加える"""
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[np.newaxis]
+        for i, frame in enumerate(frames):
+            self._add_slice(start + i, frame)
+
+    def _add_slice(self, index, frame):
+        if self.binned:
+            # 度数は符号なしとして解釈した格納値の順（_ordered_counts で並べ替える）
+            sample = frame[::HISTOGRAM_STRIDE, ::HISTOGRAM_STRIDE].view(np.dtype(f'u{self.dtype.itemsize}'))
+            counts = np.bincount(sample.ravel(), minlength=self.counts.size)
+        else:
+            step = max(frame.size // SAMPLES_PER_SLICE, 1)
+            sample = np.array(frame.ravel()[::step], dtype=np.float64)
+        low, high = frame.min(), frame.max()
+        with self._lock:
+            if not np.isnan(self.slice_min[index]):
+                return
+            if self.binned:
+                self.counts += counts
+            else:
+                self.samples[index] = sample
+            self.slice_min[index] = low
+            self.slice_max[index] = high
+
+    def _ordered_counts(self):
+        """格納値の昇順に並べた度数（インデックス0が dtype の最小値）"""
+        with self._lock:
+            counts = self.counts.copy()
+        if self.offset:
+            counts = np.roll(counts, -self.offset)
+        return counts
+
+    def _samples(self):
+        with self._lock:
+            return np.concatenate(list(self.samples.values()))
+
+    @property
+    def covered(self):
+        """統計に含まれるスライス数"""
+        return int(np.count_nonzero(~np.isnan(self.slice_min)))
+
+    def _rescaled(self, value):
+        slope, intercept = self.rescale
+        return value * slope + intercept
+
+    def stored_min(self):
+        """格納値の最小値（範囲外を埋める値などに使う）"""
+        return float(np.nanmin(self.slice_min)) if self.covered else None
+
+    def stored_range(self):
+        """デコード済みスライスの格納値の (最小, 最大)"""
+        if not self.covered:
+            return None
+        return float(np.nanmin(self.slice_min)), float(np.nanmax(self.slice_max))
+
+    def min(self):
+        return self._rescaled(float(np.nanmin(self.slice_min))) if self.covered else None
+
+    def max(self):
+        return self._rescaled(float(np.nanmax(self.slice_max))) if self.covered else None
+
+    def mean(self):
+        if not self.covered:
+            return None
+        if not self.binned:
+            return self._rescaled(float(self._samples().mean()))
+        counts = self._ordered_counts()
+        mean = float(np.dot(counts, np.arange(counts.size, dtype=np.float64)) / counts.sum()) + self.offset
+        return self._rescaled(mean)
+
+    def percentile(self, q):
+        """パーセンタイル（q は 0〜100 の数または一覧）"""
+        if not self.covered:
+            return None
+        if not self.binned:
+            return self._rescaled(np.percentile(self._samples(), q))
+        cdf = np.cumsum(self._ordered_counts())
+        targets = np.asarray(q, dtype=np.float64) / 100 * (cdf[-1] - 1)
+        return self._rescaled(np.searchsorted(cdf, targets, side='right') + self.offset)
+
+    def auto_window(self, low=1.0, high=99.0):
+        """パーセンタイル low〜high を表示範囲とする (WW, WL)"""
+        if not self.covered:
+            return None
+        lower, upper = (float(v) for v in self.percentile([low, high]))
+        return max(int(round(upper - lower)), 1), int(round((upper + lower) / 2))
+
+    def histogram(self, bins=256, value_range=None):
+        """value_range（既定: 最小〜最大）を bins 等分した (度数, 境界) を返す"""
+        if not self.covered:
+            return None
+        lower, upper = value_range if value_range is not None else (self.min(), self.max())
+        if upper <= lower:
+            upper = lower + 1
+        edges = np.linspace(lower, upper, bins + 1)
+        # 度数は格納値で持っているので、境界を格納値に戻して数える
+        slope, intercept = self.rescale
+        stored_edges = (edges - intercept) / slope
+        if not self.binned:
+            return np.histogram(self._samples(), bins=stored_edges)[0], edges
+        counts = self._ordered_counts()
+        first = int(np.ceil(stored_edges[0])) - self.offset
+        last = int(np.floor(stored_edges[-1])) - self.offset + 1
+        first, last = max(first, 0), min(last, counts.size)
+        if last <= first:
+            return np.zeros(bins, dtype=np.int64), edges
+        values = np.arange(first, last) + self.offset
+        index = np.clip(np.searchsorted(stored_edges, values, side='right') - 1, 0, bins - 1)
+        return np.bincount(index, weights=counts[first:last], minlength=bins).astype(np.int64), edges
+
+    def to_arrays(self):
+        """保存用の配列の辞書
+
+        度数を持たないdtypeは、間引いた画素を格納時のdtypeで連結し、
+        スライスごとの画素数と合わせて保存する。
+        """
+        arrays = {'slice_min': self.slice_min, 'slice_max': self.slice_max}
+        if self.binned:
+            arrays['counts'] = self.counts
+            return arrays
+        with self._lock:
+            samples = dict(self.samples)
+        sizes = np.zeros(len(self.slice_min), dtype=np.int64)
+        for index, sample in samples.items():
+            sizes[index] = sample.size
+        parts = [samples[index] for index in sorted(samples)]
+        arrays['sample_sizes'] = sizes
+        arrays['samples'] = (np.concatenate(parts) if parts else np.empty(0)).astype(self.dtype)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, dtype, arrays):
+        """to_arrays() の結果から復元する"""
+        stats = cls(dtype, len(arrays['slice_min']))
+        if stats.binned:
+            if 'counts' not in arrays:
+                raise ValueError("度数が保存されていません")
+            stats.counts = np.array(arrays['counts'], dtype=np.int64)
+        else:
+            if 'samples' not in arrays:
+                raise ValueError("間引いた画素が保存されていません")
+            sizes = np.asarray(arrays['sample_sizes'])
+            samples = np.asarray(arrays['samples'], dtype=np.float64)
+            offsets = np.concatenate([[0], np.cumsum(sizes)])
+            for index in np.flatnonzero(sizes):
+                stats.samples[int(index)] = samples[offsets[index]:offsets[index + 1]]
+        stats.slice_min = np.array(arrays['slice_min'])
+        stats.slice_max = np.array(arrays['slice_max'])
+        return stats
@@ -0,0 +1,138 @@
+"""ウィンドウ幅/レベルによる表示用uint8画像への変換"""
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _first_value(value):
+    if isinstance(value, (str, bytes)):
+        return float(value)
+    try:
+        return float(value[0])
+    except TypeError:
+        return float(value)
+
+
+def header_window(ds):
+    """ヘッダの WindowWidth / WindowCenter（複数値なら先頭）を返す。無ければ None"""
+    if not (hasattr(ds, 'WindowWidth') and hasattr(ds, 'WindowCenter')):
+        return None
+    return int(_first_value(ds.WindowWidth)), int(_first_value(ds.WindowCenter))
+
+
+def window_float(image, ww, wl, rescale=None):
+    """浮動小数点演算によるウィンドウ処理（整数以外のdtype用）
+
+    rescale に (RescaleSlope, RescaleIntercept) を渡すと、格納値を変換してから
+    ウィンドウ（CT値などの単位）を当てる。
+    """
+    image = np.asarray(image, dtype=np.float32)
+    if rescale is not None:
+        slope, intercept = rescale
+        image = image * np.float32(slope) + np.float32(intercept)
+    min_value = wl - ww / 2
+    max_value = wl + ww / 2
+
+    windowed = np.clip(image, min_value, max_value)
+    windowed = (windowed - min_value) / (max_value - min_value) * 255
+
+    return windowed.astype(np.uint8)
+
+
+class WindowingEngine:
+    """整数画像をルックアップテーブルでウィンドウ処理する
+
+    (dtype, WW, WL, リスケール) ごとに全入力値に対するuint8のLUTを作ってキャッシュし、
+    表示時は ``np.take`` 1回で再利用バッファへ書き込む。スライダー操作中に
+    同じ値へ戻った場合はLUTの再計算もメモリ確保も発生しない。
+    RescaleSlope / RescaleIntercept はLUTの作成時に格納値へ適用するので、
+    画像を浮動小数点へ変換せずにCT値でウィンドウ処理できる。
+    32ビット整数の画像は、格納値の範囲（``value_range``）が分かっていて
+    ``MAX_RANGE_LUT`` 以下ならその範囲分のLUTを作り、最小値からの差で引く。
+    LUTのキャッシュはスレッドセーフだが、名前付きバッファはUIスレッド専用。
+    """
+
+    LUT_DTYPES = (np.dtype(np.uint8), np.dtype(np.int8), np.dtype(np.uint16), np.dtype(np.int16))
+    RANGE_LUT_DTYPES = (np.dtype(np.int32), np.dtype(np.uint32))
+    MAX_RANGE_LUT = 2 ** 22
+
+    def __init__(self, max_luts=32, max_lut_bytes=64 * 1024 * 1024):
+        self.max_luts = max_luts
+        self.max_lut_bytes = max_lut_bytes
+        self._luts = OrderedDict()
+        self._lut_bytes = 0
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def supports(self, dtype, value_range=None):
+        dtype = np.dtype(dtype)
+        if dtype in self.LUT_DTYPES:
+            return True
+        return (dtype in self.RANGE_LUT_DTYPES and value_range is not None
+                and value_range[1] - value_range[0] < self.MAX_RANGE_LUT)
+
+    def lut(self, dtype, ww, wl, rescale=None, value_range=None):
+        """LUTを返す
+
+        8/16ビットのインデックスは符号なしとして解釈した格納値、32ビットは
+        value_range の最小値からの差。
+        """
+        dtype = np.dtype(dtype)
+        rescale = None if rescale is None else (float(rescale[0]), float(rescale[1]))
+        ranged = dtype not in self.LUT_DTYPES
+        key = (dtype.str, ww, wl, rescale, tuple(value_range) if ranged else None)
+        with self._lock:
+            table = self._luts.get(key)
+            if table is not None:
+                self._luts.move_to_end(key)
+                return table
+        if ranged:
+            values = np.arange(value_range[0], value_range[1] + 1, dtype=np.int64)
+        else:
+            unsigned = np.dtype(f'u{dtype.itemsize}')
+            values = np.arange(2 ** (8 * dtype.itemsize), dtype=np.int64).astype(unsigned).view(dtype)
+        table = window_float(values, ww, wl, rescale)
+        with self._lock:
+            if key not in self._luts:
+                self._luts[key] = table
+                self._lut_bytes += table.nbytes
+            while len(self._luts) > 1 and (len(self._luts) > self.max_luts or self._lut_bytes > self.max_lut_bytes):
+                _, evicted = self._luts.popitem(last=False)
+                self._lut_bytes -= evicted.nbytes
+        return table
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def apply(self, image, ww, wl, buffer=None, rescale=None, value_range=None):
+        """ウィンドウ処理したuint8画像を返す
+
+        rescale は (RescaleSlope, RescaleIntercept)。value_range は32ビット整数の
+        画像の格納値の (最小, 最大) で、範囲外の値は端の値として扱う。buffer に
+        名前を指定すると、その名前の出力バッファを使い回す（戻り値は次の同名
+        呼び出しで上書きされる）。
+        """
+        image = np.asarray(image)
+        if value_range is not None:
+            value_range = (int(math.floor(value_range[0])), int(math.ceil(value_range[1])))
+        if not self.supports(image.dtype, value_range):
+            return window_float(image, ww, wl, rescale)
+        table = self.lut(image.dtype, ww, wl, rescale, value_range)
+        if image.dtype in self.LUT_DTYPES:
+            indices = image.view(np.dtype(f'u{image.dtype.itemsize}'))
+        else:
+            low, high = value_range
+            indices = None if buffer is None else self._buffer(f"{buffer}.index", image.shape, image.dtype)
+            indices = np.clip(image, low, high, out=indices)
+            indices -= image.dtype.type(low)
+        if buffer is None:
+            return np.take(table, indices)
+        out = self._buffer(buffer, image.shape)
+        np.take(table, indices, out=out)
+        return out